@@ -0,0 +1,49 @@
+import discord
+from discord.ext import commands
+from discord import app_commands
+
+from config.config import config
+from utils.validation import validate_permissions
+
+class MediaSettings(commands.Cog):
+    """
+    Commands for setting how the guild's audio and video attachments are preprocessed.
+    """
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    @app_commands.command(name="media_limits", description="Set how audio and video are shrunk before the LLM sees them.")
+    async def media_limits(self, interaction: discord.Interaction, preprocess: bool = None, max_video_height: int = None,
+                           max_video_fps: int = None, max_video_seconds: int = None, reset: bool = False):
+        """
+        Overrides the guild's media preprocessing limits. Only the given limits are changed.
+
+        Args:
+            interaction (discord.Interaction): The interaction object representing the user's action.
+            preprocess (bool): Whether audio and video are shrunk at all.
+            max_video_height (int): The maximum height of videos, in pixels.
+            max_video_fps (int): The maximum frame rate of videos.
+            max_video_seconds (int): The maximum duration of videos, in seconds. Longer videos are cut.
+            reset (bool): Goes back to the bot-wide defaults before applying the given limits.
+        """
+        if not await validate_permissions(interaction):
+                 return
+
+        if reset:
+            config.guild_media_limits.pop(str(interaction.guild.id), None)
+        overrides = {"enabled": preprocess, "max_video_height": max_video_height,
+                     "max_video_fps": max_video_fps, "max_video_seconds": max_video_seconds}
+        if any(value is not None and value <= 0 for name, value in overrides.items() if name != "enabled"):
+            await interaction.response.send_message("Media limits must be greater than 0.", ephemeral=True)
+            return
+        await config.save_media_limits({name: value for name, value in overrides.items() if value is not None}, interaction.guild)
+
+        limits = config.media_limits(interaction.guild)
+        await interaction.response.send_message(
+            f"Media preprocessing is **{'on' if limits['enabled'] else 'off'}**. Videos are capped at "
+            f"**{limits['max_video_height']}p**, **{limits['max_video_fps']} fps** and **{limits['max_video_seconds']} s**.",
+            ephemeral=False
+        )
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(MediaSettings(bot))
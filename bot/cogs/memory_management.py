@@ -0,0 +1,48 @@
+import discord
+from discord.ext import commands, tasks
+from discord import app_commands
+
+from config.config import config
+from llm_graph.graph import graph
+from utils.validation import validate_permissions
+
+class MemoryManagement(commands.Cog):
+    """
+    Keeps the stored conversations within the memory budget.
+
+    Periodically evicts idle threads and reports how much history is stored.
+    """
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.evict_idle_threads.start()
+
+    async def cog_unload(self):
+        self.evict_idle_threads.cancel()
+
+    @tasks.loop(seconds=config.memory_budget["sweep_interval_seconds"])
+    async def evict_idle_threads(self):
+        """
+        Deletes the threads that have been idle for too long or that don't fit in the memory budget.
+        """
+        await graph.evict_idle_threads()
+
+    @app_commands.command(name="memory_usage", description="Show how many conversations are stored and their size.")
+    async def memory_usage(self, interaction: discord.Interaction):
+        """
+        Sends a message with the number of stored threads and the bytes they take up.
+
+        Args:
+            interaction (discord.Interaction): The interaction object representing the user's action.
+        """
+        if not await validate_permissions(interaction):
+                 return
+
+        threads, size = await graph.memory_usage()
+        budget = config.memory_budget["max_bytes"]
+        await interaction.response.send_message(
+            f"Stored conversations: **{threads}**, using **{size / 1024**2:.2f} MiB** of **{budget / 1024**2:.2f} MiB**.",
+            ephemeral=True
+        )
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(MemoryManagement(bot))
@@ -2,6 +2,7 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 from config.config import config
+from llm_graph.graph import graph
 from utils.validation import validate_permissions
 
 
@@ -40,7 +41,13 @@ class ModelSelect(discord.ui.Select):
             f"Selected model: **{selected_model}**",
             ephemeral=False
         )
+        previous_model = await config.current_model(interaction.guild)
         await config.save_selected_model(selected_model, interaction.guild)
+
+        # Drop the previous model's graph if no other guild uses it and compile the new one ahead of the next message.
+        if previous_model != selected_model and previous_model not in config.guild_models.values():
+            graph.invalidate_model(previous_model)
+        graph.warm_graphs([selected_model])
         await interaction.message.delete()
 
 
@@ -93,5 +100,25 @@ class SelectModel(commands.Cog):
             ephemeral=False
         )
 
+    @app_commands.command(name="context_budget", description="Choose how much conversation history the LLM reads.")
+    @app_commands.choices(budget=[app_commands.Choice(name=name, value=name) for name in config.context["budgets"]])
+    async def context_budget(self, interaction: discord.Interaction, budget: app_commands.Choice[str]):
+        """
+        Sets the guild's context budget. Smaller budgets answer faster, bigger ones remember more.
+
+        Args:
+            interaction (discord.Interaction): The interaction object representing the user's action.
+            budget (app_commands.Choice[str]): The name of the budget.
+        """
+        if not await validate_permissions(interaction):
+                 return
+
+        await config.save_context_budget(budget.value, interaction.guild)
+        tokens = config.context_budget(interaction.guild, await config.current_model(interaction.guild))
+        await interaction.response.send_message(
+            f"Context budget: **{budget.value}** ({tokens} tokens with the current model).",
+            ephemeral=False
+        )
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(SelectModel(bot))
\ No newline at end of file
@@ -0,0 +1,33 @@
+import discord
+from discord.ext import commands
+from discord import app_commands
+
+from llm_graph.search import searx_client
+from utils.validation import validate_permissions
+
+class SearchCache(commands.Cog):
+    """
+    Commands for inspecting the cache of web search results.
+    """
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    @app_commands.command(name="search_cache", description="Show how often web searches are served from the cache.")
+    async def search_cache(self, interaction: discord.Interaction):
+        """
+        Sends a message with the number of cached searches and the cache's hits and misses.
+
+        Args:
+            interaction (discord.Interaction): The interaction object representing the user's action.
+        """
+        if not await validate_permissions(interaction):
+                 return
+
+        stats = searx_client.cache.stats()
+        await interaction.response.send_message(
+            f"Cached searches: **{stats['entries']}**, hits: **{stats['hits']}**, misses: **{stats['misses']}**.",
+            ephemeral=True
+        )
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(SearchCache(bot))
@@ -4,7 +4,6 @@ from discord import app_commands
 
 from config.config import config
 from llm_graph.graph import graph
-from llm_graph.checkpoint_manager import checkpoint_manager
 
 from utils.validation import validate_permissions
 from utils.retrieve_member import retrieve_member
@@ -54,7 +53,6 @@ class SetGuildDefault(commands.Cog):
         thread_id = config.get_graph_config(interaction)["configurable"]["thread_id"]
 
         await graph.clear_history(thread_id)
-        checkpoint_manager.ai_configs = []
         await interaction.response.send_message(
             f"{bot_name}'s memory has been cleared.",
             ephemeral=False
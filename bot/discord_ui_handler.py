@@ -1,5 +1,10 @@
 import discord
+import time
 from llm_graph.checkpoint_manager import checkpoint_manager
+from llm_graph.checkpointer import thread_forget_listeners
+from llm_graph.scheduler import scheduler
+from config.config import config
+from utils.split_chunks import split_text
 
 
 class DiscordUIHandler():
@@ -7,64 +12,131 @@ class DiscordUIHandler():
     UI handler for message pagination and regeneration.
     """
     def __init__(self):
-        self.regen_buttons: RegenButtons = None
-        self.newest_messages: list = []
-        
-    async def send_message_regen(self, message: list, channel: discord.TextChannel):
-        
-        if len(message) > 1:
-            await self._delete_previous_messages()
-            for i, chunk in enumerate(message):
-                is_last_chunk = i == (len(message)-1)
-                view = self.regen_buttons if is_last_chunk else None
-                newest_llm_message = await channel.send(chunk, view=view)
-                self.newest_messages.append(newest_llm_message)
-        else:
-            view = self.regen_buttons
-            newest_llm_message = await self.newest_messages[-1].edit(content=message[-1], view=view)
-            self.newest_messages = [newest_llm_message]
-            
+        self.newest_messages: dict[str, list] = {} # Thread ID -> the bot's latest messages in that thread.
 
+    def forget(self, thread_id: str) -> None:
+        """
+        Drops the messages tracked for the given thread.
+        """
+        self.newest_messages.pop(thread_id, None)
 
-    async def send_message(self, message: list, channel: discord.TextChannel):
+    async def send_message_regen(self, message: list, channel: discord.TextChannel, regen_buttons: "RegenButtons"):
+        """
+        Shows a regenerated or paged answer in place of the thread's newest messages. Chunks that didn't
+        change are kept, the rest are edited, and missing or extra messages are sent or deleted.
+        """
+        thread_id = regen_buttons.thread_id
+        self.newest_messages[thread_id] = await reconcile_messages(self.newest_messages.get(thread_id, []), message, channel, regen_buttons)
+
+    async def send_message(self, message: list, channel: discord.TextChannel, regen_buttons: "RegenButtons"):
         """
         Sends the given string to Discord.
         """
         new_messages = []
-        await self._clear_previous_view()
+        await self._clear_previous_view(regen_buttons.thread_id)
         for i, chunk in enumerate(message):
 
             is_last_chunk = i == (len(message)-1)
-            view = self.regen_buttons if is_last_chunk else None
+            view = regen_buttons if is_last_chunk else None
             newest_llm_message = await channel.send(chunk, view=view)
             new_messages.append(newest_llm_message)
-        self.newest_messages = new_messages
+        self.newest_messages[regen_buttons.thread_id] = new_messages
+
 
+    async def start_stream(self, channel: discord.TextChannel, regen_buttons: "RegenButtons") -> "StreamingReply":
+        """
+        Posts a placeholder message that will show the response while it's generated.
+        """
+        await self._clear_previous_view(regen_buttons.thread_id)
+        reply = StreamingReply(channel, config.streaming["edit_interval_seconds"])
+        await reply.start()
+        return reply
 
-    async def _delete_previous_messages(self):
+    async def finish_stream(self, reply: "StreamingReply", message: list, regen_buttons: "RegenButtons"):
         """
-        Deletes all previous messages if the newest messages list has more than 1 item.
+        Makes the streamed messages show the final chunks of the response and attaches the regeneration buttons.
         """
-        if len(self.newest_messages) > 1:
-            for message in self.newest_messages: # Delete the newest messages if there are any.
-                    await message.delete()
-            self.newest_messages=[]
+        await reply.finish(message, regen_buttons)
+        self.newest_messages[regen_buttons.thread_id] = reply.messages
 
-    async def _clear_previous_view(self):
+    async def _clear_previous_view(self, thread_id: str):
         """
-        Removes the view (buttons) from the last message in the newest messages list.
+        Removes the view (buttons) from the last message in the thread's newest messages list.
         """
-        if len(self.newest_messages) != 0:
-            await self.newest_messages[-1].edit(view=None)
+        if len(self.newest_messages.get(thread_id, [])) != 0:
+            await self.newest_messages[thread_id][-1].edit(view=None)
+
+async def reconcile_messages(current: list, chunks: list, channel: discord.TextChannel, view: discord.ui.View = None) -> list:
+    """
+    Makes the given Discord messages show the given chunks. Messages whose content changed are edited,
+    missing ones are sent and extra ones are deleted. The view is attached to the last message.
+
+    Args:
+        current (list): The messages currently showing the response, in order.
+        chunks (list): The chunks to show.
+        channel (discord.TextChannel): The channel to send missing messages to.
+        view (discord.ui.View): The view for the last message.
+    Returns:
+        list: The messages showing the chunks.
+    """
+    messages = []
+    for i, chunk in enumerate(chunks):
+        is_last_chunk = i == (len(chunks)-1)
+        chunk_view = view if is_last_chunk else None
+        if i < len(current):
+            message = current[i]
+            had_view = i == (len(current)-1) # Only the previous last message can hold a view.
+            if message.content != chunk or (is_last_chunk and view is not None) or (had_view and not is_last_chunk):
+                message = await message.edit(content=chunk, view=chunk_view)
+        else:
+            message = await channel.send(chunk, view=chunk_view)
+        messages.append(message)
+    for message in current[len(chunks):]:
+        await message.delete()
+    return messages
 
-discord_ui_handler = DiscordUIHandler() 
+
+class StreamingReply:
+    """
+    Shows a response in Discord while it's being generated.
+
+    The text is split like the final response, so a new message is started every 2000 characters. Edits
+    are throttled to the given interval to stay within Discord's rate limits.
+    """
+    def __init__(self, channel: discord.TextChannel, edit_interval: float):
+        self.channel = channel
+        self.edit_interval = edit_interval
+        self.messages: list[discord.Message] = []
+        self._last_edit = 0.0
+
+    async def start(self):
+        self.messages = [await self.channel.send("...")]
+
+    async def update(self, text: str):
+        """
+        Shows the text generated so far, unless the last edit was too recent.
+        """
+        if not text.strip() or time.monotonic() - self._last_edit < self.edit_interval:
+            return
+        self._last_edit = time.monotonic()
+        self.messages = await reconcile_messages(self.messages, split_text(text, 2000), self.channel)
+
+    async def finish(self, chunks: list, view: discord.ui.View):
+        """
+        Shows the final chunks of the response with the given view on the last message.
+        """
+        self.messages = await reconcile_messages(self.messages, chunks, self.channel, view)
+
+discord_ui_handler = DiscordUIHandler()
+thread_forget_listeners.append(discord_ui_handler.forget)
 
 class RegenButtons(discord.ui.View):
     """
     View class for regeneration buttons.
     """
-    def __init__(self):
+    def __init__(self, thread_id: str):
         super().__init__()
+        self.thread_id = thread_id # The conversation thread these buttons navigate.
 
     async def _on_navigation_change(self):
         """
@@ -72,37 +144,41 @@ class RegenButtons(discord.ui.View):
 
         Enables or disables buttons and updates the repeat button label with the current indices.
         """
-        self.children[0].disabled=checkpoint_manager.can_go_backward  # self.children is a class attribute that holds the views  
-        self.children[1].disabled=checkpoint_manager.can_go_forward   # that have been created in the class.
-        self.children[2].label=f"🔁 {checkpoint_manager.indices}"  # Update the repeat button with new indices.
+        state = checkpoint_manager.thread_state(self.thread_id)
+        self.children[0].disabled=state.can_go_backward  # self.children is a class attribute that holds the views
+        self.children[1].disabled=state.can_go_forward   # that have been created in the class.
+        self.children[2].label=f"🔁 {state.indices}"  # Update the repeat button with new indices.
 
     # Button views.
     @discord.ui.button(label="⬅️", style=discord.ButtonStyle.blurple, disabled=True)
     async def left_navigation_button(self, interaction: discord.Interaction, button: discord.Button):
-        
+
         await interaction.response.defer() # Defer the response to avoid having the
                                            # "Interaction failed" warning on the Discord message.
-        regen_msg = await checkpoint_manager.page_backward() 
-        await self._on_navigation_change()
+        async with scheduler.slot(self.thread_id): # Waits for any generation running in this thread.
+            regen_msg = await checkpoint_manager.page_backward(self.thread_id)
+            await self._on_navigation_change()
 
-        await discord_ui_handler.send_message_regen(regen_msg, interaction.channel)
+            await discord_ui_handler.send_message_regen(regen_msg, interaction.channel, self)
 
     @discord.ui.button(label="➡️", style=discord.ButtonStyle.blurple, disabled=True)
     async def right_navigation_button(self, interaction: discord.Interaction, button: discord.Button):
 
         await interaction.response.defer()
 
-        regen_msg =  await checkpoint_manager.page_forward()
-        await self._on_navigation_change()
+        async with scheduler.slot(self.thread_id):
+            regen_msg =  await checkpoint_manager.page_forward(self.thread_id)
+            await self._on_navigation_change()
 
-        await discord_ui_handler.send_message_regen(regen_msg, interaction.channel)
+            await discord_ui_handler.send_message_regen(regen_msg, interaction.channel, self)
 
     @discord.ui.button(label="🔁", style=discord.ButtonStyle.blurple)
     async def regeneration_button(self, interaction: discord.Interaction, button: discord.Button):
 
         await interaction.response.defer()
 
-        regen_msg = await checkpoint_manager.regeneration(interaction)
-        await self._on_navigation_change()
+        async with scheduler.slot(self.thread_id):
+            regen_msg = await checkpoint_manager.regeneration(interaction)
+            await self._on_navigation_change()
 
-        await discord_ui_handler.send_message_regen(regen_msg, interaction.channel)
\ No newline at end of file
+            await discord_ui_handler.send_message_regen(regen_msg, interaction.channel, self)
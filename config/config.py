@@ -1,9 +1,13 @@
 import json
+import atexit
 import discord
-import asyncio
 from typing import Union
+from config.config_store import ConfigStore
 
 class Config:
+    GUILD_ATTRS = ["guild_models", "guild_sys_prompts", "guild_allowed_channels_id", "config_roles", "guild_media_limits", "guild_context_budgets"] # Per-guild settings, kept in the config store.
+    STATIC_ATTRS = ["model_list", "help_commands", "checkpointer", "memory_budget", "config_store", "max_concurrent_generations", "coalescing", "streaming", "http", "files_api", "media", "search", "summarization", "context"] # Bot-wide settings, read from config.json.
+
     def __init__(self):
         self.guild_models = {}
         self.guild_sys_prompts = {}
@@ -11,7 +15,20 @@ class Config:
         self.model_list = {}
         self.help_commands = {}
         self.config_roles = {}
-        self._save_lock = asyncio.Lock()
+        self.guild_media_limits = {}
+        self.guild_context_budgets = {}
+        self.checkpointer = {}
+        self.memory_budget = {}
+        self.config_store = {}
+        self.max_concurrent_generations = 1
+        self.coalescing = {}
+        self.streaming = {}
+        self.http = {}
+        self.files_api = {}
+        self.media = {}
+        self.search = {}
+        self.summarization = {}
+        self.context = {}
 
         self.load_config()
 
@@ -19,28 +36,39 @@ class Config:
         self.default_model = "gemini-2.0-flash-lite"
 
     def load_config(self):
+        with open(f"config/config.json", "r") as file:
+            data=json.load(file)
         # List the attribute names that need configuration.
-        for attr in ["guild_models", "guild_sys_prompts", "guild_allowed_channels_id", "model_list", "help_commands", "config_roles"]:
-            with open(f"config/config.json", "r") as file:
-                data=json.load(file)
-                loaded_data=data[attr]
+        for attr in self.STATIC_ATTRS:
             # Update the attribute on the instance. 
-            setattr(self, attr, loaded_data)
+            setattr(self, attr, data[attr])
+
+        self.store = ConfigStore(self.config_store["path"], self.config_store["debounce_seconds"])
+        atexit.register(self.store.close) # Writes any pending change before exiting.
+        if self.store.get_meta("migrated") is None: # Migrates the guild settings from config.json the first time the store is used.
+            if self.store.is_empty(): # A store filled before migrations were recorded is kept as is.
+                for attr in self.GUILD_ATTRS:
+                    for key, value in data.get(attr, {}).items():
+                        self.store.set(attr, key, value)
+                self.store.flush_sync()
+            self.store.set_meta("migrated", "1") # From now on the guild sections of config.json are ignored.
+        for attr in self.GUILD_ATTRS:
+            setattr(self, attr, self.store.load(attr))
 
-    async def save_config(self, attr, data):
+    async def save_config(self, attr, key):
         """
-        Saves the given configuration data to a JSON file.
+        Saves a guild's value of the given attribute. The write is debounced and batched with other changes
+        by the config store.
 
         Args:
             attr (str): The name of the attribute to save.
-            data (dict): The data to save in the JSON file.
+            key (str): The guild ID whose value should be saved. If the guild has no value, it's deleted.
         """
-        async with self._save_lock: 
-            with open(f"config/config.json", "r") as file:
-                config_file = json.load(file)
-                config_file[f"{attr}"] = data
-            with open(f"config/config.json", "w") as file:
-                json.dump(config_file, file, indent=4)
+        data = getattr(self, attr)
+        if key in data:
+            self.store.set(attr, key, data[key])
+        else:
+            self.store.delete(attr, key)
 
     # Methods for models.
         
@@ -52,7 +80,7 @@ class Config:
         key = str(guild.id)
         if not key in self.guild_models.keys():
             self.guild_models[key] = "gemini-2.0-flash-lite"
-            await self.save_config("guild_models", self.guild_models)
+            await self.save_config("guild_models", key)
 
     async def save_selected_model(self, model: str, guild: discord.Guild):
         """
@@ -67,7 +95,7 @@ class Config:
 
         key = str(guild.id)
         self.guild_models[key] = model  
-        await self.save_config("guild_models", self.guild_models)
+        await self.save_config("guild_models", key)
 
     async def current_model(self, guild) -> str:
         """
@@ -89,7 +117,7 @@ class Config:
         key = str(guild.id)
 
         self.guild_sys_prompts[key] = sys_prompt
-        await self.save_config("guild_sys_prompts", self.guild_sys_prompts)
+        await self.save_config("guild_sys_prompts", key)
         return await self.initialize_system_prompt(guild, bot_name)
 
 
@@ -101,16 +129,71 @@ class Config:
         # Check if the key is in the system prompts dictionary
         if not key in self.guild_sys_prompts:
             self.guild_sys_prompts[key] = self.default_sys_prompt # If it isn't, then create a new one with the default message.
-            await self.save_config("guild_sys_prompts", self.guild_sys_prompts) 
+            await self.save_config("guild_sys_prompts", key) 
 
         # Check if the name is in the system prompt
         if not "$name" in self.guild_sys_prompts[key]:
             self.guild_sys_prompts[key] =  f"{self.guild_sys_prompts[key]} Your name is $name"
-            await self.save_config("guild_sys_prompts", self.guild_sys_prompts)
+            await self.save_config("guild_sys_prompts", key)
 
         formatted_sys_prompt: str = self.guild_sys_prompts[key].replace("$name", bot_name)
         return formatted_sys_prompt
 
+    # Context budget methods.
+
+    def budget_name(self, guild: discord.Guild = None) -> str:
+        """
+        Returns the name of the given guild's context budget. Direct messages use the default budget.
+        """
+        name = self.guild_context_budgets.get(str(guild.id)) if guild else None
+        return name if name in self.context["budgets"] else self.context["default_budget"]
+
+    def context_budget(self, guild: discord.Guild, model: str) -> int:
+        """
+        Returns how many input tokens a request may use: the guild's budget, capped by what the model's
+        context window can take besides the room kept for the answer.
+        """
+        window = self.context["windows"].get(model, self.context["default_window"])
+        output_reserve = min(self.context["output_reserve"], window // 4) # Small windows can't spare the full reserve.
+        return min(self.context["budgets"][self.budget_name(guild)], window - output_reserve)
+
+    def supports_system_instruction(self, model: str) -> bool:
+        """
+        Returns False for the models whose API rejects system instructions, like Gemma.
+        """
+        return model not in self.context["without_system_instruction"]
+
+    async def save_context_budget(self, name: str, guild: discord.Guild) -> None:
+        key = str(guild.id)
+        self.guild_context_budgets[key] = name
+        await self.save_config("guild_context_budgets", key)
+
+    # Media methods.
+
+    def media_limits(self, guild: discord.Guild = None) -> dict:
+        """
+        Returns the media preprocessing limits of the given guild: the bot-wide defaults with the guild's
+        overrides applied. Direct messages use the defaults.
+        """
+        overrides = self.guild_media_limits.get(str(guild.id), {}) if guild else {}
+        return {**self.media["preprocess"], **overrides}
+
+    async def save_media_limits(self, overrides: dict, guild: discord.Guild) -> None:
+        """
+        Updates the given guild's overrides of the media preprocessing limits.
+
+        Args:
+            overrides (dict): The limits to override. Limits set to None go back to the bot-wide default.
+        """
+        key = str(guild.id)
+        limits = {**self.guild_media_limits.get(key, {}), **overrides}
+        limits = {name: value for name, value in limits.items() if value is not None}
+        if limits:
+            self.guild_media_limits[key] = limits
+        else:
+            self.guild_media_limits.pop(key, None)
+        await self.save_config("guild_media_limits", key)
+
     # Channel permission methods.
 
     async def allow_channel(self, channel: discord.TextChannel=None) -> None:
@@ -123,10 +206,10 @@ class Config:
         if key in self.guild_allowed_channels_id:
             if channel.id not in self.guild_allowed_channels_id[key]:
                 self.guild_allowed_channels_id[key].append(channel.id)
-                await self.save_config("guild_allowed_channels_id", self.guild_allowed_channels_id)
+                await self.save_config("guild_allowed_channels_id", key)
         else:
             self.guild_allowed_channels_id[key] = [channel.id]
-            await self.save_config("guild_allowed_channels_id", self.guild_allowed_channels_id)
+            await self.save_config("guild_allowed_channels_id", key)
 
     async def disallow_channel(self, channel: discord.TextChannel=None) -> bool:
         """
@@ -142,7 +225,7 @@ class Config:
             self.guild_allowed_channels_id[key].remove(channel.id) # Will except if no channels with that ID exist.
             if len(self.guild_allowed_channels_id[key]) - 1 < 0: # If the length of the list inside the dictionary is less than 0...
                 del self.guild_allowed_channels_id[key] #... remove the dictionary entirely. This means that if the dictionary has no items in its list it will be removed.
-            await self.save_config("guild_allowed_channels_id", self.guild_allowed_channels_id)
+            await self.save_config("guild_allowed_channels_id", key)
             return True
         except (ValueError, KeyError):
             return False
@@ -152,12 +235,9 @@ class Config:
         Delete the guild's every stored variable from the config.
         """
         key = str(guild.id)
-        del self.guild_allowed_channels_id[key]
-        del self.guild_models[key]
-        del self.guild_sys_prompts[key]
-        await self.save_config("guild_allowed_channels_id", self.guild_allowed_channels_id)
-        await self.save_config("guild_models", self.guild_models)
-        await self.save_config("guild_sys_prompts", self.guild_sys_prompts)
+        for attr in self.GUILD_ATTRS:
+            getattr(self, attr).pop(key, None)
+            await self.save_config(attr, key)
 
     async def set_guild_vars_default(self, guild: discord.Guild) -> None:
             """
@@ -166,14 +246,18 @@ class Config:
             key = str(guild.id)
             self.guild_models[key] = self.default_model
             self.guild_sys_prompts[key] = self.default_sys_prompt
+            self.guild_media_limits.pop(key, None)
+            self.guild_context_budgets.pop(key, None)
 
-            await self.save_config("guild_models", self.guild_models)
-            await self.save_config("guild_sys_prompts", self.guild_sys_prompts)
+            await self.save_config("guild_models", key)
+            await self.save_config("guild_sys_prompts", key)
+            await self.save_config("guild_media_limits", key)
+            await self.save_config("guild_context_budgets", key)
 
     async def save_role(self, role: str, guild: discord.Guild) -> None:
         key = str(guild.id)
         self.config_roles[key] = int(role.strip("<@&>"))
-        await self.save_config("config_roles", self.config_roles)
+        await self.save_config("config_roles", key)
 
     #make the config for setting role for permission checking
     
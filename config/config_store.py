@@ -0,0 +1,123 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+
+_DELETED = object() # Marks a pending deletion.
+
+class ConfigStore:
+    """
+    Stores the per-guild settings in a SQLite database, one row per setting and guild.
+
+    Writes are debounced: they're kept in memory for a short while and then written together in a single
+    transaction, so a burst of changes costs one write. Reads never go through the store, the Config
+    instance keeps its own in-memory view.
+    """
+    def __init__(self, path: str, debounce_seconds: float = 1.0):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.debounce_seconds = debounce_seconds
+        self._pending: dict[tuple[str, str], object] = {} # (attribute, guild ID) -> serialized value to write.
+        self._flush_task: asyncio.Task = None
+        self._flush_lock = asyncio.Lock() # Keeps flushes in order, so an older value never overwrites a newer one.
+        self._lock = threading.Lock() # The connection is shared between the event loop and worker threads.
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS guild_settings (attr TEXT NOT NULL, guild_id TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (attr, guild_id))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM guild_settings LIMIT 1").fetchone() is None
+
+    def get_meta(self, key: str) -> str:
+        """
+        Returns a value stored about the store itself, e.g. whether the settings were migrated, or None.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        """
+        Stores a value about the store itself. It's written right away.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def load(self, attr: str) -> dict:
+        """
+        Loads every guild's value of the given attribute.
+
+        Returns:
+            dict: The values keyed by guild ID.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT guild_id, value FROM guild_settings WHERE attr = ?", (attr,)).fetchall()
+        return {guild_id: json.loads(value) for guild_id, value in rows}
+
+    def set(self, attr: str, key: str, value) -> None:
+        """
+        Schedules the given guild's value of the attribute to be written.
+        """
+        self._pending[(attr, key)] = json.dumps(value) # Serialized right away so later changes don't leak in.
+        self._schedule_flush()
+
+    def delete(self, attr: str, key: str) -> None:
+        """
+        Schedules the given guild's value of the attribute to be deleted.
+        """
+        self._pending[(attr, key)] = _DELETED
+        self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError: # No event loop, so there's nothing to debounce with.
+            self.flush_sync()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        while True:
+            await asyncio.sleep(self.debounce_seconds)
+            await self.flush()
+            if not self._pending: # Changes made during the flush are written by the next round.
+                break
+
+    async def flush(self) -> None:
+        """
+        Writes every pending change in a worker thread. The pending changes are taken on the event loop,
+        so changes made while the write runs are kept for the next flush.
+        """
+        async with self._flush_lock:
+            pending, self._pending = self._pending, {}
+            await asyncio.to_thread(self._write, pending)
+
+    def flush_sync(self) -> None:
+        """
+        Writes every pending change in a single transaction. Used when there's no event loop running.
+        """
+        pending, self._pending = self._pending, {}
+        self._write(pending)
+
+    def _write(self, pending: dict) -> None:
+        """
+        Writes the given changes in a single transaction.
+        """
+        if not pending:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM guild_settings WHERE attr = ? AND guild_id = ?",
+                                   [key for key, value in pending.items() if value is _DELETED])
+            self._conn.executemany("INSERT OR REPLACE INTO guild_settings (attr, guild_id, value) VALUES (?, ?, ?)",
+                                   [(*key, value) for key, value in pending.items() if value is not _DELETED])
+
+    def close(self) -> None:
+        self.flush_sync()
+        with self._lock:
+            self._conn.close()
@@ -1,10 +1,13 @@
 import discord
-from llm_graph.message_processor import MessageProcessor
+import asyncio
+from llm_graph.message_processor import MessageProcessor, merge_messages
 from llm_graph.checkpoint_manager import checkpoint_manager
+from llm_graph.scheduler import scheduler
 from bot.discord_ui_handler import discord_ui_handler, RegenButtons
 from discord.ext import commands
 from config.config import config
 
+FAILED_RESPONSE = "Error: \n\nThe response couldn't be generated. Press 🔁 to try again.\n\nContact Discord user 'limonero.' or start an issue on Tauleph's GitHub page if this is a recurring error."
 
 
 async def entry_point(message: discord.Message, bot: commands.Bot):
@@ -14,17 +17,49 @@ async def entry_point(message: discord.Message, bot: commands.Bot):
     This function is called to start the message processing flow.
     """
 
-    # Initiate variables.
-    discord_ui_handler.regen_buttons = RegenButtons()
-    
-    # Process the message.
+    thread_id = config.get_graph_config(message)["configurable"]["thread_id"]
+    coalescing = config.coalescing
+
+    # The message starts processing right away, while it waits for its turn.
     message_processor = MessageProcessor(message, bot)
-    result = await message_processor.process_message()
-    # Get the API response.
-    
-    llm_output = await checkpoint_manager.response(result[0], result[1], message)
+    processing = asyncio.create_task(message_processor.process_message())
+    scheduler.enqueue(thread_id, (message_processor, processing))
+
+    if coalescing["enabled"] and not scheduler.is_busy(thread_id):
+        await asyncio.sleep(coalescing["window_seconds"]) # Gives a burst of messages the chance to be answered together.
+
+    # Messages of the same channel are answered one at a time and in order, while other channels run in parallel.
+    async with scheduler.slot(thread_id):
+        # Every message waiting in the thread is answered in one reply. Without coalescing, only the oldest one is.
+        batch = scheduler.take_pending(thread_id, coalescing["max_batch"] if coalescing["enabled"] else 1)
+        if not batch: # This message was already answered along with an earlier one.
+            return
+
+        # Initiate variables.
+        regen_buttons = RegenButtons(thread_id)
 
-    await discord_ui_handler.send_message(llm_output, message.channel)
+        # Process the messages.
+        results = await asyncio.gather(*(processing for _, processing in batch), return_exceptions=True)
+        processed = [(processor, result) for (processor, _), result in zip(batch, results) if not isinstance(result, BaseException)]
+        for result in results:
+            if isinstance(result, BaseException):
+                print(f"Error processing message: {result}")
+        if not processed:
+            return
+        user_input, system_input = merge_messages(processed)
+        # Get the API response.
 
+        # If generating fails, the reply shows an error and keeps the buttons, so the answer can be regenerated.
+        llm_output = [FAILED_RESPONSE]
+        if config.streaming["enabled"]: # Shows the response while it's generated.
+            reply = await discord_ui_handler.start_stream(message.channel, regen_buttons)
+            try:
+                llm_output = await checkpoint_manager.response(user_input, system_input, processed[-1][0].message, on_text=reply.update)
+            finally:
+                await discord_ui_handler.finish_stream(reply, llm_output, regen_buttons)
+            return
 
-    
\ No newline at end of file
+        try:
+            llm_output = await checkpoint_manager.response(user_input, system_input, processed[-1][0].message)
+        finally:
+            await discord_ui_handler.send_message(llm_output, message.channel, regen_buttons)
@@ -1,21 +1,76 @@
 from langchain_core.messages import HumanMessage, SystemMessage
 from llm_graph.graph import graph
 from llm_graph.graph_manager import config_history, ai_config_history
+from llm_graph.checkpointer import thread_forget_listeners
 from config.config import config
+from collections import OrderedDict
 import discord
 
 
-class CheckpointManager:
+class ThreadState:
+    """
+    Regeneration state of a single conversation thread.
+    """
+    max_cached_pages = 25 # Rendered answers kept in memory for paging.
+
     def __init__(self):
         self.current_index = 0
         self.ai_configs = []
-        self.guild: discord.Guild = None
-        
-    async def response(self, user_input: str, system_input: str, message: discord.Message):
+        self.pages: OrderedDict[str, list] = OrderedDict() # Checkpoint ID -> chunks of the answer, least recently used first.
+
+    def cache_page(self, config: dict, chunks: list) -> None:
+        """
+        Stores the rendered chunks of the answer in the given config.
+        """
+        self.pages[config["configurable"]["checkpoint_id"]] = chunks
+        self.pages.move_to_end(config["configurable"]["checkpoint_id"])
+        while len(self.pages) > self.max_cached_pages:
+            self.pages.popitem(last=False)
+
+    @property
+    def current_config(self):
+        if 0 <= self.current_index < len(self.ai_configs):
+            return self.ai_configs[self.current_index]
+        return None
+
+    @property
+    def can_go_backward(self):
+        return self.current_index - 1 < 0 #Returns True if current_index is lower than 0, and viceversa
+
+    @property
+    def can_go_forward(self):
+        return self.current_index + 1 > len(self.ai_configs) - 1 #Returns True if current_index is higher than the current number of indices, and viceversa
+
+    @property
+    def indices(self):
+        return f"{self.current_index+1}/{len(self.ai_configs)}"
+
+
+class CheckpointManager:
+    def __init__(self):
+        self.threads: dict[str, ThreadState] = {} # Thread ID -> regeneration state.
+
+    def thread_state(self, thread_id: str) -> ThreadState:
+        """
+        Returns the regeneration state of the given thread, creating it if needed.
+        """
+        return self.threads.setdefault(thread_id, ThreadState())
+
+    def forget(self, thread_id: str) -> None:
+        """
+        Drops the regeneration state of the given thread.
+        """
+        self.threads.pop(thread_id, None)
+
+    async def response(self, user_input: str, system_input: str, message: discord.Message, on_text=None):
         """
         Invokes the LLM for a response.
+
+        Args:
+            on_text (Callable): Optional coroutine called with the text generated so far while the response streams.
         """
-        compiled_graph = graph.setup_graph(await config.current_model(message.guild))
+        model = await config.current_model(message.guild)
+        compiled_graph = graph.get_graph(model)
 
         #Prepare initial messages.
         user_message = HumanMessage(
@@ -27,54 +82,59 @@ class CheckpointManager:
         initial_messages = [user_message, system_message]
         #Process input.
         graph_config = config.get_graph_config(message)
-        response = await graph.run_graph(compiled_graph, graph_config, initial_messages)
-        self.current_index=0 #Resets all the indices.
-        self.ai_configs = []
+        response = await graph.run_graph(compiled_graph, graph_config, initial_messages, on_text,
+                                         token_budget=config.context_budget(message.guild, model),
+                                         media_limits=config.media_limits(message.guild))
+        self.threads[graph_config["configurable"]["thread_id"]] = ThreadState() #Resets all the indices.
         return response
-    
+
     async def regeneration(self, interaction: discord.Interaction):
         """
         Invokes the LLM for a regeneration.
         """
         graph_config = config.get_graph_config(interaction)
-        compiled_graph = graph.setup_graph(await config.current_model(interaction.guild))
+        state = self.thread_state(graph_config["configurable"]["thread_id"])
+        model = await config.current_model(interaction.guild)
+        compiled_graph = graph.get_graph(model)
         new_config = await config_history(compiled_graph, graph_config)
-        response = await graph.run_graph(compiled_graph, new_config)
-        self.ai_configs = await ai_config_history(compiled_graph, graph_config) 
-        self.current_index = len(self.ai_configs)-1
+        previous_answers = len(await ai_config_history(compiled_graph, graph_config))
+        response = await graph.run_graph(compiled_graph, new_config, token_budget=config.context_budget(interaction.guild, model),
+                                         media_limits=config.media_limits(interaction.guild))
+        state.ai_configs = await ai_config_history(compiled_graph, graph_config)
+        state.current_index = len(state.ai_configs)-1
+        if len(state.ai_configs) > previous_answers: # Only a successful regeneration adds an answer.
+            state.cache_page(state.current_config, response) # Paging back to this answer won't need the checkpointer.
         return response
-    
-    async def page_backward(self):
-        if not self.can_go_backward:
-            self.current_index-=1
-            msg = (await graph.memory.aget(self.current_config))["channel_values"]["messages"][-1].content
-            return msg
-        return ["None."]
-    
-    async def page_forward(self):
-        if not self.can_go_forward:
-            self.current_index+=1
-            msg = (await graph.memory.aget(self.current_config))["channel_values"]["messages"][-1].content
-            return msg
-        return ["None."]
 
-    @property
-    def current_config(self):
-        if 0 <= self.current_index < len(self.ai_configs):
-            return self.ai_configs[self.current_index]
-        return None
+    async def page_backward(self, thread_id: str):
+        state = self.thread_state(thread_id)
+        if not state.can_go_backward:
+            state.current_index-=1
+            return await self._page_content(state)
+        return ["None."]
 
-    @property
-    def can_go_backward(self):
-        return self.current_index - 1 < 0 #Returns True if current_index is lower than 0, and viceversa 
+    async def page_forward(self, thread_id: str):
+        state = self.thread_state(thread_id)
+        if not state.can_go_forward:
+            state.current_index+=1
+            return await self._page_content(state)
+        return ["None."]
 
-    @property
-    def can_go_forward(self):
-        return self.current_index + 1 > len(self.ai_configs) - 1 #Returns True if current_index is higher than the current number of indices, and viceversa 
+    async def _page_content(self, state: ThreadState):
+        """
+        Returns the content of the AI message in the thread's current config.
+        """
+        checkpoint_id = state.current_config["configurable"]["checkpoint_id"]
+        if checkpoint_id in state.pages:
+            state.pages.move_to_end(checkpoint_id)
+            return state.pages[checkpoint_id]
 
-    @property
-    def indices(self):
-        return f"{self.current_index+1}/{len(self.ai_configs)}"
+        checkpoint = await graph.memory.aget(state.current_config)
+        if checkpoint is None: # The thread was cleared or evicted in the meantime.
+            return ["None."]
+        chunks = checkpoint["channel_values"]["messages"][-1].content
+        state.cache_page(state.current_config, chunks)
+        return chunks
 
 checkpoint_manager = CheckpointManager()
-
+thread_forget_listeners.append(checkpoint_manager.forget) # Evicted and purged threads lose their cached pages.
@@ -0,0 +1,295 @@
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from llm_graph.graph_manager import regen_index
+from collections import OrderedDict
+from abc import ABC, abstractmethod
+from typing import Callable
+import aiosqlite
+import asyncio
+import time
+import os
+
+thread_forget_listeners: list[Callable[[str], None]] = [] # Called with the ID of every deleted thread, so in-memory state about it is dropped too.
+
+
+class BatchedConnection:
+    """
+    Wraps an aiosqlite connection so that commits are coalesced.
+
+    Every commit request is delayed by a short interval and all the writes made in between are committed
+    together. Reads made through the same connection already see the uncommitted writes. Commits take the
+    saver's lock, so they never land in the middle of an operation that spans several statements.
+    """
+    def __init__(self, conn: aiosqlite.Connection, commit_delay: float):
+        self._conn = conn
+        self._commit_delay = commit_delay
+        self._commit_task: asyncio.Task = None
+        self.lock: asyncio.Lock = asyncio.Lock() # Replaced by the saver's lock once the saver is created.
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __await__(self):
+        return self._conn.__await__()
+
+    async def commit(self) -> None:
+        """
+        Schedules a commit, unless one is already pending.
+        """
+        if self._commit_task is None or self._commit_task.done():
+            self._commit_task = asyncio.create_task(self._delayed_commit())
+
+    async def _delayed_commit(self) -> None:
+        await asyncio.sleep(self._commit_delay)
+        async with self.lock:
+            await self._conn.commit()
+
+    async def flush(self) -> None:
+        """
+        Commits the pending writes right away.
+        """
+        if self._commit_task is not None and not self._commit_task.done():
+            self._commit_task.cancel()
+        async with self.lock:
+            await self._conn.commit()
+
+    async def close(self) -> None:
+        await self.flush()
+        await self._conn.close()
+
+
+class ThreadEvictionMixin(ABC):
+    """
+    Keeps track of when every thread was last written to, so idle threads can be evicted.
+
+    Threads are kept in least recently used order. Checkpointers using this mixin must implement
+    athread_sizes.
+    """
+    def _init_activity(self) -> None:
+        self.thread_activity: OrderedDict[str, float] = OrderedDict() # Thread ID -> last write time, oldest first.
+
+    def _touch(self, thread_id: str, timestamp: float = None) -> None:
+        """
+        Marks the thread as the most recently used one.
+        """
+        self.thread_activity[thread_id] = timestamp or time.time()
+        self.thread_activity.move_to_end(thread_id)
+
+    def _forget(self, thread_id: str) -> None:
+        """
+        Drops everything tracked about a deleted thread.
+        """
+        self.thread_activity.pop(str(thread_id), None)
+        regen_index.forget(str(thread_id))
+        for listener in thread_forget_listeners:
+            listener(str(thread_id))
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        next_config = await super().aput(config, checkpoint, metadata, new_versions)
+        self._touch(str(config["configurable"]["thread_id"]))
+        regen_index.record(next_config, checkpoint) # Keeps the regeneration targets up to date as checkpoints are written.
+        return next_config
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await super().adelete_thread(thread_id)
+        self._forget(thread_id)
+
+    @abstractmethod
+    async def athread_sizes(self) -> dict[str, int]:
+        """
+        Returns the approximate size in bytes of every stored thread.
+        """
+
+    async def ausage(self) -> tuple[int, int]:
+        """
+        Returns how many threads are stored and how many bytes they take up.
+        """
+        sizes = await self.athread_sizes()
+        return len(sizes), sum(sizes.values())
+
+    async def aevict(self, max_bytes: int, idle_ttl: float) -> list[str]:
+        """
+        Deletes the threads that have been idle for longer than the given time, and then the least recently
+        used threads until the stored history fits in the given budget.
+
+        Args:
+            max_bytes (int): The maximum amount of bytes the stored threads can take up.
+            idle_ttl (float): The seconds after which an idle thread is deleted.
+        Returns:
+            list[str]: The IDs of the deleted threads.
+        """
+        sizes = await self.athread_sizes()
+        for thread_id in sizes.keys() - self.thread_activity.keys(): # Threads stored before tracking started.
+            self._touch(thread_id)
+
+        evicted = []
+        idle_before = time.time() - idle_ttl
+        for thread_id, last_active in list(self.thread_activity.items()):
+            if last_active < idle_before:
+                evicted.append(thread_id)
+
+        total_bytes = sum(sizes.values()) - sum(sizes.get(thread_id, 0) for thread_id in evicted)
+        for thread_id in self.thread_activity.keys(): # Least recently used threads come first.
+            if total_bytes <= max_bytes:
+                break
+            if thread_id not in evicted:
+                evicted.append(thread_id)
+                total_bytes -= sizes.get(thread_id, 0)
+
+        for thread_id in evicted:
+            await self.adelete_thread(thread_id)
+        return evicted
+
+    async def apurge_guild(self, guild_id: int) -> list[str]:
+        """
+        Deletes every thread of the given guild.
+
+        Returns:
+            list[str]: The IDs of the deleted threads.
+        """
+        sizes = await self.athread_sizes()
+        purged = [thread_id for thread_id in sizes if thread_id.startswith(f"{guild_id}-")]
+        for thread_id in purged:
+            await self.adelete_thread(thread_id)
+        return purged
+
+
+class MemoryCheckpointer(ThreadEvictionMixin, InMemorySaver):
+    """
+    In-memory checkpointer with idle thread eviction. Nothing is kept after a restart.
+    """
+    def __init__(self):
+        super().__init__()
+        self._init_activity()
+
+    async def athread_sizes(self) -> dict[str, int]:
+        sizes = {}
+        for thread_id, namespaces in self.storage.items():
+            sizes[thread_id] = sum(len(checkpoint[1]) + len(metadata[1])
+                                   for checkpoints in namespaces.values()
+                                   for checkpoint, metadata, _ in checkpoints.values())
+        for (thread_id, *_), writes in self.writes.items():
+            sizes[thread_id] = sizes.get(thread_id, 0) + sum(len(write[2][1]) for write in writes.values())
+        for (thread_id, *_), blob in self.blobs.items():
+            sizes[thread_id] = sizes.get(thread_id, 0) + len(blob[1])
+        return sizes
+
+
+class SqliteCheckpointer(ThreadEvictionMixin, AsyncSqliteSaver):
+    """
+    Checkpointer that stores the conversations in a WAL-mode SQLite database on disk.
+
+    Checkpoints and writes are looked up through their primary keys, which index
+    (thread_id, checkpoint_ns, checkpoint_id), so only the rows being read are loaded in memory.
+    """
+    @classmethod
+    async def open(cls, path: str, commit_delay: float = 0.2) -> "SqliteCheckpointer":
+        """
+        Opens (or creates) the checkpoint database at the given path.
+
+        Args:
+            path (str): The path of the SQLite file.
+            commit_delay (float): How many seconds writes are batched for before being committed.
+        Returns:
+            SqliteCheckpointer: The ready to use checkpointer.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = await aiosqlite.connect(path)
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL") # In WAL mode this only syncs on checkpoints, not every commit.
+        batched_conn = BatchedConnection(conn, commit_delay)
+        checkpointer = cls(batched_conn)
+        batched_conn.lock = checkpointer.lock
+        await checkpointer.setup()
+        await checkpointer._load_activity()
+        return checkpointer
+
+    async def _load_activity(self) -> None:
+        """
+        Creates the thread activity table and loads it in least recently used order.
+        """
+        self._init_activity()
+        await self.conn.execute("CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, last_active REAL NOT NULL)")
+        async with self.conn.execute("SELECT thread_id, last_active FROM thread_activity ORDER BY last_active") as cursor:
+            async for thread_id, last_active in cursor:
+                self._touch(thread_id, last_active)
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        next_config = await super().aput(config, checkpoint, metadata, new_versions)
+        thread_id = str(config["configurable"]["thread_id"])
+        async with self.lock: # Stores the activity so idle threads are still evicted after a restart.
+            await self.conn.execute("INSERT OR REPLACE INTO thread_activity (thread_id, last_active) VALUES (?, ?)",
+                                    (thread_id, self.thread_activity[thread_id]))
+            await self.conn.commit()
+        return next_config
+
+    async def athread_sizes(self) -> dict[str, int]:
+        await self.setup()
+        sizes = {}
+        async with self.conn.execute("SELECT thread_id, SUM(LENGTH(checkpoint) + LENGTH(metadata)) FROM checkpoints GROUP BY thread_id") as cursor:
+            async for thread_id, size in cursor:
+                sizes[thread_id] = size or 0
+        async with self.conn.execute("SELECT thread_id, SUM(LENGTH(value)) FROM writes GROUP BY thread_id") as cursor:
+            async for thread_id, size in cursor:
+                sizes[thread_id] = sizes.get(thread_id, 0) + (size or 0)
+        return sizes
+
+    async def migrate_from(self, previous: BaseCheckpointSaver) -> int:
+        """
+        Copies every checkpoint and pending write of the given checkpointer into this one.
+        Used when switching away from the in-memory checkpointer without losing the current conversations.
+
+        Returns:
+            int: The number of copied checkpoints.
+        """
+        checkpoint_tuples = [checkpoint_tuple async for checkpoint_tuple in previous.alist(None)]
+        for checkpoint_tuple in reversed(checkpoint_tuples): # Oldest checkpoints first, so parents exist before children.
+            configurable = checkpoint_tuple.config["configurable"]
+            parent_config = checkpoint_tuple.parent_config or {
+                "configurable": {"thread_id": configurable["thread_id"], "checkpoint_ns": configurable.get("checkpoint_ns", "")}
+            }
+            parent_config["configurable"].setdefault("checkpoint_ns", configurable.get("checkpoint_ns", ""))
+            new_config = await self.aput(parent_config, checkpoint_tuple.checkpoint, checkpoint_tuple.metadata, {})
+
+            writes_by_task = {}
+            for task_id, channel, value in checkpoint_tuple.pending_writes or []:
+                writes_by_task.setdefault(task_id, []).append((channel, value))
+            for task_id, writes in writes_by_task.items():
+                await self.aput_writes(new_config, writes, task_id)
+        await self.conn.flush()
+        return len(checkpoint_tuples)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        """
+        Deletes every checkpoint and write of the given thread.
+        """
+        await self.setup()
+        async with self.lock:
+            await self.conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (str(thread_id),))
+            await self.conn.execute("DELETE FROM writes WHERE thread_id = ?", (str(thread_id),))
+            await self.conn.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+            await self.conn.commit()
+        self._forget(thread_id)
+
+    async def aclose(self) -> None:
+        """
+        Commits the pending writes and closes the database.
+        """
+        await self.conn.close()
+
+
+async def create_checkpointer(settings: dict) -> BaseCheckpointSaver:
+    """
+    Creates the checkpointer described by the given settings.
+
+    Args:
+        settings (dict): The "checkpointer" section of the config. "backend" is either "sqlite" or "memory".
+    Returns:
+        BaseCheckpointSaver: The created checkpointer.
+    """
+    if settings.get("backend", "sqlite") == "memory":
+        return MemoryCheckpointer()
+    return await SqliteCheckpointer.open(settings.get("path", "data/checkpoints.sqlite"),
+                                         settings.get("commit_delay", 0.2))
@@ -0,0 +1,140 @@
+from config.config import config
+from google import genai
+from io import BytesIO
+import asyncio
+import hashlib
+import sqlite3
+import time
+import os
+
+
+def hash_content(file) -> str:
+    """
+    Returns the SHA-256 hash of the given file object or bytes. File objects are read in chunks and rewound.
+    """
+    if isinstance(file, bytes):
+        return hashlib.sha256(file).hexdigest()
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(1024 * 1024), b""):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+async def ahash_content(file) -> str:
+    """
+    Hashes the given file object or bytes in a worker thread, so large media doesn't block the event loop.
+    """
+    return await asyncio.to_thread(hash_content, file)
+
+
+class FilesApiCache:
+    """
+    Persistent cache of the files uploaded to the Files API, keyed by content hash and MIME type.
+
+    Uploaded files expire after a while, so every entry stores its expiry time and expired entries are
+    never returned.
+    """
+    def __init__(self, path: str, expiry_margin: float):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.expiry_margin = expiry_margin # Seconds before the real expiry an entry stops being used.
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS uploads (content_hash TEXT NOT NULL, mime_type TEXT NOT NULL, name TEXT NOT NULL, uri TEXT NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (content_hash, mime_type))")
+        self.evict_expired()
+
+    def get(self, content_hash: str, mime_type: str) -> str:
+        """
+        Returns the URI of the uploaded file with the given content and MIME type, or None if there's no
+        valid upload.
+        """
+        row = self._conn.execute("SELECT uri FROM uploads WHERE content_hash = ? AND mime_type = ? AND expires_at > ?",
+                                 (content_hash, mime_type, time.time() + self.expiry_margin)).fetchone()
+        return row[0] if row else None
+
+    def put(self, content_hash: str, mime_type: str, name: str, uri: str, expires_at: float) -> None:
+        """
+        Stores an uploaded file.
+
+        Args:
+            expires_at (float): The UNIX timestamp at which the Files API deletes the file.
+        """
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO uploads (content_hash, mime_type, name, uri, expires_at) VALUES (?, ?, ?, ?, ?)",
+                               (content_hash, mime_type, name, uri, expires_at))
+
+    def evict_expired(self) -> None:
+        """
+        Deletes the entries that expired or are about to.
+        """
+        with self._conn:
+            self._conn.execute("DELETE FROM uploads WHERE expires_at <= ?", (time.time() + self.expiry_margin,))
+
+files_api_cache = FilesApiCache(config.files_api["cache_path"], config.files_api["expiry_margin_seconds"])
+
+
+class FilesApiClient:
+    """
+    Shared asynchronous client for the Files API.
+
+    Uploads don't block the event loop, so several attachments can upload at once. Processing is polled
+    with an exponential backoff that starts with a short interval, so small files are ready as soon as
+    possible. Upload and processing times are recorded in the metrics.
+    """
+    def __init__(self, settings: dict, cache: FilesApiCache):
+        self.settings = settings
+        self.cache = cache
+        self._client: genai.Client = None
+        self.metrics = {"uploads": 0, "cache_hits": 0, "upload_seconds": 0.0, "processing_seconds": 0.0}
+
+    @property
+    def client(self) -> genai.Client:
+        """
+        The shared client. It's created on first use, once the API key has been loaded.
+        """
+        if self._client is None:
+            self._client = genai.Client()
+        return self._client
+
+    async def upload(self, media_content, mime_type: str) -> str:
+        """
+        Uploads the media and waits until it's processed. Media that was already uploaded and hasn't expired
+        is reused without uploading it again.
+
+        Args:
+            media_content (Union[bytes, IO]): The media to upload.
+            mime_type (str): The MIME type of the media.
+        Returns:
+            str: The URI of the uploaded file.
+        """
+        file_data = BytesIO(media_content) if isinstance(media_content, bytes) else media_content
+        content_hash = await ahash_content(file_data)
+        cached_uri = self.cache.get(content_hash, mime_type)
+        if cached_uri:
+            self.metrics["cache_hits"] += 1
+            return cached_uri
+
+        start = time.perf_counter()
+        myfile = await self.client.aio.files.upload(file=file_data, config={"mime_type": mime_type})
+        uploaded = time.perf_counter()
+
+        # Wait for processing, doubling the interval between checks.
+        interval = self.settings["poll_initial_seconds"]
+        while myfile.state.name == "PROCESSING":
+            if time.perf_counter() - uploaded > self.settings["processing_timeout_seconds"]:
+                raise TimeoutError(f"{myfile.name} took too long to be processed.")
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.settings["poll_max_seconds"])
+            myfile = await self.client.aio.files.get(name=myfile.name)
+        processed = time.perf_counter()
+
+        self.metrics["uploads"] += 1
+        self.metrics["upload_seconds"] += uploaded - start
+        self.metrics["processing_seconds"] += processed - uploaded
+        print(f"Uploaded {myfile.name} ({mime_type}): upload {uploaded - start:.2f}s, processing {processed - uploaded:.2f}s.")
+
+        if myfile.state.name == "ACTIVE" and myfile.expiration_time:
+            self.cache.put(content_hash, mime_type, myfile.name, myfile.uri, myfile.expiration_time.timestamp())
+        return myfile.uri
+
+files_api_client = FilesApiClient(config.files_api, files_api_cache)
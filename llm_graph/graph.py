@@ -1,47 +1,242 @@
 from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_google_genai.chat_models import ChatGoogleGenerativeAIError
 from google.api_core.exceptions import GoogleAPIError
 #from langchain_groq import ChatGroq
-from langchain_core.messages import AIMessage
-from typing import Annotated
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, SystemMessage, RemoveMessage, ToolMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+from typing import Annotated, Awaitable, Callable, Iterable
+from collections import OrderedDict
 from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.graph import CompiledGraph
 from langgraph.graph.message import add_messages 
-from langchain_community.utilities import SearxSearchWrapper
-from langchain_community.tools.searx_search.tool import SearxSearchResults
 from langgraph.prebuilt import ToolNode, tools_condition
 from textwrap import TextWrapper
 from langchain_core.messages import trim_messages
 from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from dotenv import load_dotenv
+import uuid
 from utils.split_chunks import split_text
+from llm_graph.token_counter import estimate_tokens, merge_token_counts, truncate_tool_message
+from llm_graph.summarizer import messages_to_fold, summarize
+from llm_graph.prompt import with_instruction
+from llm_graph.checkpointer import create_checkpointer, MemoryCheckpointer
+from config.config import config
+from llm_graph.search import search_tools, compact_tool_message
 load_dotenv() #Loads environment variables.
-searx_search = SearxSearchWrapper(searx_host="http://localhost:32787") #SearxSearchWrapper is a class that allows you to interact with the Searx API.
-searx_tool = SearxSearchResults(wrapper=searx_search, num_results=10) #SearxSearchResults is a class that allows you to get search results from Searx.
+
+def _inline_media_note(part):
+    """
+    Returns a text note in place of an inline media part, or the part itself if it isn't inline media.
+    """
+    if not isinstance(part, dict):
+        return part
+    if part.get("type") == "image_url":
+        url = part["image_url"].get("url", "") if isinstance(part["image_url"], dict) else part["image_url"]
+        if url.startswith("data:"):
+            return {"type": "text", "text": "[An image was sent here.]"}
+    if part.get("type") == "media" and "data" in part:
+        kind = part.get("mime_type", "").split("/")[0]
+        return {"type": "text", "text": f"[{'An audio file' if kind == 'audio' else 'A video'} was sent here.]"}
+    return part
 
 class State(TypedDict): 
     messages: Annotated[list, add_messages] #Creates the state. The state is a dictionary that contains the messages.
+    token_counts: Annotated[dict, merge_token_counts] #Estimated token count of every message, keyed by message ID.
+    summary: str #Summary of the messages that were folded out of the history.
 
 class Graph:
     def __init__(self):
-        self.token_count: int = 500000
-        self.memory = InMemorySaver()
+        self.token_count: int = 500000 # Context budget of the runs that aren't given one.
+        self.memory: BaseCheckpointSaver = MemoryCheckpointer() # Replaced by the configured checkpointer in setup_memory.
+        self.max_cached_models: int = len(config.model_list) # One cached graph and client per selectable model at most.
+        self.compiled_graphs: OrderedDict[str, CompiledGraph] = OrderedDict() # Least recently used models come first.
+        self.llm_clients: OrderedDict[str, tuple[ChatGoogleGenerativeAI, Runnable]] = OrderedDict()
+
+    def message_trimming(self, state: State, token_counts: dict, max_tokens: int):
+        """
+        Trims the message history to the token limit using the cached token count of each message.
+
+        The current turn, from the latest HumanMessage on, is always kept, so a tool call is never sent
+        without its result and the prompt is never empty. If the turn alone is over the limit, its tool
+        results are truncated to fit, and their counts are updated in the given dict. Older turns are
+        kept, newest first, while they fit in what's left.
+
+        Args:
+            state (State): The state holding the messages.
+            token_counts (dict): The token count of every message in the state, keyed by message ID.
+            max_tokens (int): The context budget of the request.
+        """
+        messages = state["messages"]
+        human_indices = [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)]
+        turn_start = human_indices[-1] if human_indices else 0
+        history, current_turn = messages[:turn_start], messages[turn_start:]
+
+        turn_tokens = sum(token_counts[message.id] for message in current_turn)
+        if turn_tokens > max_tokens:
+            current_turn = self._truncate_tool_results(current_turn, token_counts, max_tokens)
+            turn_tokens = sum(token_counts[message.id] for message in current_turn)
+
+        # Walk from the newest message backwards until the limit is reached.
+        window_start = len(history)
+        total_tokens = turn_tokens
+        for i in range(len(history) - 1, -1, -1):
+            total_tokens += token_counts[history[i].id]
+            if total_tokens > max_tokens:
+                break
+            window_start = i
 
-    def message_trimming(self, state: State, llm: ChatGoogleGenerativeAI):
-        trimmed_messages = trim_messages(
-            state["messages"],
+        trimmed_history = trim_messages(
+            history[window_start:],
             strategy="last",
-            token_counter=llm,
-            max_tokens=self.token_count,
+            token_counter=lambda counted: sum(token_counts[message.id] for message in counted),
+            max_tokens=max(max_tokens - turn_tokens, 0),
             start_on="human",
-            end_on=("human", "system", "tool"),
-            include_system=True,
-            )
-        
-        state["messages"] = trimmed_messages
+            ) if window_start < len(history) else []
+
+        state["messages"] = [*trimmed_history, *current_turn]
 
         return state["messages"]
 
+    def _truncate_tool_results(self, turn: list, token_counts: dict, max_tokens: int) -> list:
+        """
+        Truncates the tool results of the turn so the turn fits in the limit. The room left by the other
+        messages is shared evenly, and results smaller than their share give the rest to the bigger ones.
+        """
+        tool_messages = sorted((message for message in turn if isinstance(message, ToolMessage)), key=lambda message: token_counts[message.id])
+        room = max_tokens - sum(token_counts[message.id] for message in turn if not isinstance(message, ToolMessage))
+        truncated = {}
+        for remaining, message in zip(range(len(tool_messages), 0, -1), tool_messages):
+            share = max(room // remaining, 0)
+            truncated[message.id] = truncate_tool_message(message, share)
+            token_counts[message.id] = estimate_tokens(truncated[message.id])
+            room -= token_counts[message.id]
+        if tool_messages:
+            print(f"Truncated the tool results of a turn over the budget of {max_tokens} tokens.")
+        return [truncated.get(message.id, message) for message in turn]
+
+    async def fold_history(self, llm: ChatGoogleGenerativeAI, state: State, token_counts: dict, max_tokens: int, system_instruction: bool = True) -> tuple[str, list]:
+        """
+        Folds the oldest messages of a long thread into its summary, so the prompt stays roughly the same
+        size however long the thread gets. The folded messages are removed from the given state.
+
+        Args:
+            llm (ChatGoogleGenerativeAI): The model that writes the summary.
+            state (State): The state holding the messages and the current summary.
+            token_counts (dict): The token count of every message in the state, keyed by message ID.
+            max_tokens (int): The context budget of the request. Smaller budgets fold sooner.
+            system_instruction (bool): Whether the model accepts system instructions.
+        Returns:
+            tuple[str, list]: The summary and the RemoveMessages of the folded messages.
+        """
+        summary = state.get("summary", "")
+        settings = {**config.summarization, # Bigger budgets fold later and keep more of the history word for word.
+                    "trigger_tokens": int(max_tokens * config.summarization["trigger_fraction"]),
+                    "keep_tokens": int(max_tokens * config.summarization["keep_fraction"])}
+        folded = messages_to_fold(state["messages"], token_counts, settings) if settings["enabled"] else []
+        if not folded:
+            return summary, []
+        try:
+            summary = await summarize(llm, summary, folded, settings, system_instruction)
+        except Exception as e: # The summary is best-effort: the turn is answered with the trimmed history and the thread is folded on a later turn.
+            print(f"Error summarizing the history: {e!r}")
+            return state.get("summary", ""), []
+        print(f"Folded {len(folded)} messages into the summary.")
+        state["messages"] = state["messages"][len(folded):]
+        return summary, [RemoveMessage(id=message.id) for message in folded]
+
+    def build_prompt(self, messages: list, summary: str, system_instruction: bool = True) -> list:
+        """
+        Returns the messages to send to the LLM. Every turn stores its own system prompt, but only the
+        latest one is sent, followed by the summary of the folded history, as a single instruction.
+        The older system prompts are left out, so the prompt is the same whether or not the thread was
+        summarized.
+
+        Args:
+            messages (list): The trimmed messages.
+            summary (str): The summary of the folded history. Empty if there's none.
+            system_instruction (bool): Whether the model accepts system instructions. If it doesn't,
+                the instruction is put at the start of the first HumanMessage.
+        Returns:
+            list: The instruction followed by the conversation.
+        """
+        conversation = [message for message in messages if not isinstance(message, SystemMessage)]
+        system_prompts = [message for message in messages if isinstance(message, SystemMessage)]
+        instruction = [system_prompts[-1].content] if system_prompts else []
+        if summary:
+            instruction.append(f"Summary of the earlier conversation:\n{summary}")
+        return with_instruction("\n\n".join(instruction), conversation, system_instruction)
+
+    def drop_inline_media(self, messages: list) -> list:
+        """
+        Returns copies of the messages that carry inline media, with the media replaced by a short note.
+        The media of the latest turns, as many as set in the config, is kept, so follow-up questions can
+        still look at it. The copies keep the IDs of the originals, so they replace them in the state and
+        the media bytes aren't written to every later checkpoint. The checkpoint a turn started from still
+        holds them, so regenerations see the media.
+
+        Args:
+            messages (list): The messages in the state.
+        Returns:
+            list: The copies of the messages whose inline media is dropped.
+        """
+        human_messages = [message for message in messages if isinstance(message, HumanMessage)]
+        keep_turns = config.media["keep_inline_turns"]
+        replacements = []
+        for message in human_messages[:len(human_messages) - keep_turns] if keep_turns else human_messages:
+            if not isinstance(message.content, list):
+                continue
+            content = [_inline_media_note(part) for part in message.content]
+            if content != message.content:
+                replacements.append(message.model_copy(update={"content": content}))
+        return replacements
+
+    async def setup_memory(self) -> None:
+        """
+        Replaces the in-memory checkpointer with the one set in the config, copying over any conversation
+        that was already stored in memory. Must be awaited once the event loop is running.
+        """
+        if not isinstance(self.memory, InMemorySaver) or config.checkpointer.get("backend") == "memory":
+            return
+        previous_memory = self.memory
+        self.memory = await create_checkpointer(config.checkpointer)
+        migrated = await self.memory.migrate_from(previous_memory)
+        if migrated:
+            print(f"Migrated {migrated} checkpoints to the {config.checkpointer['backend']} checkpointer.")
+        self.compiled_graphs.clear() # The cached graphs were compiled with the previous checkpointer.
+
+    async def close_memory(self) -> None:
+        """
+        Flushes and closes the checkpointer if it's backed by a database.
+        """
+        if hasattr(self.memory, "aclose"):
+            await self.memory.aclose()
+
+    async def evict_idle_threads(self) -> list[str]:
+        """
+        Deletes idle threads and, if the stored history is over the memory budget, the least recently used ones.
+
+        Returns:
+            list[str]: The IDs of the deleted threads.
+        """
+        evicted = await self.memory.aevict(config.memory_budget["max_bytes"], config.memory_budget["idle_ttl_seconds"])
+        if evicted:
+            print(f"Evicted {len(evicted)} idle threads.")
+        return evicted
+
+    async def purge_guild_history(self, guild_id: int) -> list[str]:
+        """
+        Deletes every thread of the given guild. Called when the bot is removed from a guild.
+        """
+        return await self.memory.apurge_guild(guild_id)
+
+    async def memory_usage(self) -> tuple[int, int]:
+        """
+        Returns how many threads are stored and how many bytes they take up.
+        """
+        return await self.memory.ausage()
+
     async def clear_history(self, thread_id: str):
         """
         Clears the chat history for a specific thread ID using the checkpointer.
@@ -55,27 +250,109 @@ class Graph:
             print(f"Error clearing history for thread {thread_id}: {e}")
 
 
-    def setup_graph(self, input_model: str) -> CompiledGraph:
-        graph_builder = StateGraph(State) #StateGraph is a class that creates a graph with the state.
+    def get_llm(self, input_model: str) -> tuple[ChatGoogleGenerativeAI, Runnable]:
+        """
+        Returns the cached LLM client of the given model along with its tool-bound version, creating them if needed.
+        """
+        if input_model in self.llm_clients:
+            self.llm_clients.move_to_end(input_model) # Marks the model as the most recently used.
+            return self.llm_clients[input_model]
 
         llm = ChatGoogleGenerativeAI(model=input_model,
                                     max_retries=6,
                                     timeout=2)
-        tools = [searx_tool]
-        
-        llm_with_tools = llm.bind_tools(tools)
+        llm_with_tools = llm.bind_tools(search_tools)
+
+        self.llm_clients[input_model] = (llm, llm_with_tools)
+        self._evict_least_used(self.llm_clients)
+        return self.llm_clients[input_model]
+
+    def get_graph(self, input_model: str) -> CompiledGraph:
+        """
+        Returns the cached compiled graph of the given model, compiling it only the first time it's requested.
+        """
+        if input_model in self.compiled_graphs:
+            self.compiled_graphs.move_to_end(input_model)
+            return self.compiled_graphs[input_model]
+
+        self.compiled_graphs[input_model] = self.setup_graph(input_model)
+        self._evict_least_used(self.compiled_graphs)
+        return self.compiled_graphs[input_model]
+
+    def warm_graphs(self, models: Iterable[str]) -> None:
+        """
+        Compiles the graphs of the given models ahead of time so the first messages don't pay for it.
+        Models that aren't in the model list are ignored.
+        """
+        for model in models:
+            if model in config.model_list:
+                self.get_graph(model)
 
-        def chatbot(state: State) -> dict:
-            #Trimming message history.
-            trimmed_messages = self.message_trimming(state, llm)
+    def invalidate_model(self, input_model: str) -> None:
+        """
+        Drops the cached graph and LLM client of the given model. They will be rebuilt the next time they're needed.
+        """
+        self.compiled_graphs.pop(input_model, None)
+        self.llm_clients.pop(input_model, None)
 
-            #LLM calling.
-            response = {"messages": [llm_with_tools.invoke(trimmed_messages)]}
+    def _evict_least_used(self, cache: OrderedDict) -> None:
+        """
+        Removes the least recently used entries of the given cache until it fits in the model limit.
+        """
+        while len(cache) > max(self.max_cached_models, 1):
+            cache.popitem(last=False)
+
+    def setup_graph(self, input_model: str) -> CompiledGraph:
+        graph_builder = StateGraph(State) #StateGraph is a class that creates a graph with the state.
+
+        llm, llm_with_tools = self.get_llm(input_model)
+        tools = search_tools
+        system_instruction = config.supports_system_instruction(input_model)
+        default_media_limits = config.media_limits() # For runs that aren't given a guild's limits.
+
+        async def chatbot(state: State, config: RunnableConfig) -> dict:
+            max_tokens = config["configurable"].get("token_budget", self.token_count)
+            media_limits = config["configurable"].get("media_limits", default_media_limits)
+
+            #Counting the tokens of the messages that haven't been counted yet.
+            cached_counts = state.get("token_counts", {})
+            new_counts = {message.id: estimate_tokens(message, media_limits) for message in state["messages"] if message.id not in cached_counts}
+
+            #Folding the oldest messages into the summary once the thread is too long.
+            summary, removals = await self.fold_history(llm, state, {**cached_counts, **new_counts}, max_tokens, system_instruction)
+            new_counts.update({removal.id: None for removal in removals}) #Drops the counts of the folded messages.
+
+            #Trimming message history, leaving room for the summary.
+            unfolded_messages = state["messages"]
+            summary_tokens = estimate_tokens(SystemMessage(content=summary)) if summary else 0
+            counts = {**cached_counts, **new_counts}
+            trimmed_messages = self.message_trimming(state, counts, max_tokens - summary_tokens)
+            prompt = self.build_prompt(trimmed_messages, summary, system_instruction)
+            used_tokens = sum(counts.get(message.id) or estimate_tokens(message) for message in prompt)
+            print(f"{config['configurable']['thread_id']}: sending ~{used_tokens} of {max_tokens} budgeted tokens to {input_model}.")
+
+            #LLM calling. Awaiting the call lets the event loop serve other conversations in the meantime.
+            ai = await llm_with_tools.ainvoke(prompt)
+
+            #Once the turn is answered, older inline media is swapped for a note so later checkpoints stay small.
+            replacements = [] if ai.tool_calls else self.drop_inline_media(unfolded_messages)
+            new_counts.update({message.id: estimate_tokens(message, media_limits) for message in replacements})
+
+            response = {"messages": [*removals, *replacements, ai]}
+            if removals:
+                response["summary"] = summary
 
             #Splitting text into lists of 2000 characters.
             chunked_lines=split_text(response["messages"][-1].content, 2000)
             response["messages"][-1].content = chunked_lines
 
+            #Counting the response once, so later steps only read its cached count.
+            ai_message = response["messages"][-1]
+            if ai_message.id is None:
+                ai_message.id = str(uuid.uuid4())
+            new_counts[ai_message.id] = estimate_tokens(ai_message)
+            response["token_counts"] = new_counts
+
             return response
         
         def chatbot_mock(state: State) -> dict:
@@ -97,8 +374,16 @@ class Graph:
             state["messages"][-1] = AIMessage(content=chunked_lines)
             return state
 
+        tool_node = ToolNode(tools)
+
+        async def tools_node(state: State, config: RunnableConfig) -> dict:
+            #Running the tools and compacting their results in the same step, so only the compact results are checkpointed.
+            result = await tool_node.ainvoke(state, config)
+            result["messages"] = [compact_tool_message(message) for message in result["messages"]]
+            return result
+
         graph_builder.add_node("chatbot", chatbot) #Adds the chatbot node to the graph.
-        graph_builder.add_node("tools", ToolNode(tools)) #Adds the tools node to the graph.
+        graph_builder.add_node("tools", tools_node) #Adds the tools node to the graph.
         graph_builder.add_conditional_edges("chatbot", tools_condition) #Adds conditional edges between the chatbot and tools nodes.
         graph_builder.add_edge("tools", "chatbot") #Adds an edge between the tools and chatbot nodes.
         graph_builder.set_entry_point("chatbot") #Sets the entry point of the graph to the chatbot node.
@@ -106,15 +391,50 @@ class Graph:
 
         return runnable #Returns the runnable graph.
 
-    async def run_graph(self, graph: CompiledGraph, config, initial_messages=None) -> str:
+    async def run_graph(self, graph: CompiledGraph, config, initial_messages=None, on_text: Callable[[str], Awaitable[None]] = None, token_budget: int = None, media_limits: dict = None) -> str:
         """
         Processes the input messages through the graph and returns the last message.
+
+        Args:
+            graph (CompiledGraph): The graph to run.
+            config (dict): The graph config of the thread.
+            initial_messages (list): The new input messages. None resumes the graph from the config's checkpoint.
+            on_text (Callable): If given, the LLM's token stream is used and this coroutine is called with the
+                text generated so far every time a new token arrives.
+            token_budget (int): The most input tokens the LLM calls of this run may use. Defaults to token_count.
+            media_limits (dict): The guild's media preprocessing limits, used to estimate audio and video. Defaults to the bot-wide ones.
         """
+        graph_input = {"messages": initial_messages} if initial_messages else None
+        extra = {name: value for name, value in (("token_budget", token_budget), ("media_limits", media_limits)) if value is not None}
+        if extra: # Handed to the nodes through the config, without changing the caller's.
+            config = {**config, "configurable": {**config["configurable"], **extra}}
         try:
-            response = await graph.ainvoke({"messages": initial_messages}, config) if initial_messages else await graph.ainvoke(None, config) 
-        except GoogleAPIError as e:
+            if on_text is None:
+                response = await graph.ainvoke(graph_input, config)
+            else:
+                response = await self._stream_graph(graph, config, graph_input, on_text)
+        except (GoogleAPIError, ChatGoogleGenerativeAIError) as e: # The library reports rejected requests, like 400s, with its own error.
             response = f"Error: \n\n{e}\n\nContact Discord user 'limonero.' or start an issue on Tauleph's GitHub page if this is a recurring error."
             return [response]
         return response["messages"][-1].content
 
+    async def _stream_graph(self, graph: CompiledGraph, config, graph_input, on_text: Callable[[str], Awaitable[None]]) -> dict:
+        """
+        Runs the graph streaming the chatbot's tokens to the given callback, and returns the final state.
+        """
+        text = ""
+        current_step = None
+        async for chunk, metadata in graph.astream(graph_input, config, stream_mode="messages"):
+            if metadata.get("langgraph_node") != "chatbot" or not isinstance(chunk, AIMessageChunk):
+                continue
+            if metadata.get("langgraph_step") != current_step: # A new LLM call, e.g. after a tool call, starts a new text.
+                current_step = metadata.get("langgraph_step")
+                text = ""
+            if isinstance(chunk.content, str) and chunk.content:
+                text += chunk.content
+                await on_text(text)
+
+        latest_config = {"configurable": {"thread_id": config["configurable"]["thread_id"]}} # Without the checkpoint ID of a regeneration.
+        return (await graph.aget_state(latest_config)).values
+
 graph = Graph()
@@ -1,44 +1,94 @@
 from langchain_core.messages import AIMessage, ToolMessage
 from langgraph.graph.graph import CompiledGraph
-from typing import AsyncIterator
-from langgraph.types import StateSnapshot
+from contextlib import aclosing
 
 
-async def config_history(graph: CompiledGraph, config: dict) -> dict:
+def _is_answer(message) -> bool:
+    """
+    Returns True if the message is a final AI answer, that is, an AIMessage with content that doesn't call tools.
+    """
+    return isinstance(message, AIMessage) and bool(message.content) and not message.tool_calls
+
+def _is_intermediate(message) -> bool:
     """
-    Returns the last config in the state if it isn't an AIMessage.   
+    Returns True if the message is part of a tool call: a ToolMessage or an AIMessage calling tools.
     """
-    state_history: AsyncIterator[StateSnapshot] = graph.aget_state_history(config)
-    configs=[]
+    return isinstance(message, ToolMessage) or (isinstance(message, AIMessage) and not _is_answer(message))
+
 
-    async for state in state_history:
-        messages = state.values.get("messages", []) #Gets the messages in the state.
-        if messages:
-            last_message=messages[-1] #Gets the last message in the messages.
+class RegenIndex:
+    """
+    Index of the regeneration targets of every thread, kept up to date as checkpoints are written.
+
+    For each thread it stores the config of the last non-AI checkpoint, which regenerations resume from,
+    and the configs of the AI answers generated from it, oldest first.
+    """
+    def __init__(self):
+        self.regen_targets: dict[str, dict] = {} # Thread ID -> config of the last non-AI checkpoint.
+        self.ai_answers: dict[str, list] = {} # Thread ID -> configs of the sibling AI answers.
+
+    def record(self, config: dict, checkpoint: dict) -> None:
+        """
+        Updates the index with a checkpoint that was just written.
+
+        Args:
+            config (dict): The config of the written checkpoint.
+            checkpoint (dict): The written checkpoint.
+        """
+        messages = checkpoint.get("channel_values", {}).get("messages")
+        if not messages or _is_intermediate(messages[-1]):
+            return
+        thread_id = str(config["configurable"]["thread_id"])
+        if _is_answer(messages[-1]):
+            if thread_id in self.regen_targets: # Answers of threads that aren't indexed yet are found by seed.
+                self.ai_answers[thread_id].append(config)
         else:
-            break
-        if not isinstance(last_message, AIMessage): #Checks if the last message is not an AIMessage.
-            configs.append(state.config) #Appends the config to the configs list.
-    return configs[0]
+            self.regen_targets[thread_id] = config
+            self.ai_answers[thread_id] = []
+
+    def forget(self, thread_id: str) -> None:
+        self.regen_targets.pop(thread_id, None)
+        self.ai_answers.pop(thread_id, None)
+
+    async def seed(self, graph: CompiledGraph, config: dict) -> None:
+        """
+        Indexes a thread that was written before the index existed, e.g. before a restart. Checkpoints are
+        read one at a time from the newest, and the walk stops at the last non-AI checkpoint, so only the
+        latest turn is loaded and the checkpointer isn't held for the whole history. Does nothing if the
+        thread is already indexed.
+        """
+        thread_id = str(config["configurable"]["thread_id"])
+        if thread_id in self.regen_targets:
+            return
+        thread_config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+        answers = []
+
+        async with aclosing(graph.checkpointer.alist(thread_config)) as checkpoint_tuples: # Closing releases the checkpointer's lock.
+            async for checkpoint_tuple in checkpoint_tuples: #The checkpoints go from newest to oldest.
+                messages = checkpoint_tuple.checkpoint.get("channel_values", {}).get("messages", []) #Gets the messages in the checkpoint.
+                if not messages:
+                    break
+                last_message=messages[-1] #Gets the last message in the messages.
+                if _is_answer(last_message):
+                    answers.append(checkpoint_tuple.config)
+                elif not _is_intermediate(last_message): #The last non-AI checkpoint ends the search.
+                    self.regen_targets[thread_id] = checkpoint_tuple.config
+                    self.ai_answers[thread_id] = list(reversed(answers))
+                    return
+
+regen_index = RegenIndex()
+
+
+async def config_history(graph: CompiledGraph, config: dict) -> dict:
+    """
+    Returns the last config in the state if it isn't an AIMessage.
+    """
+    await regen_index.seed(graph, config)
+    return regen_index.regen_targets.get(str(config["configurable"]["thread_id"]))
 
 async def ai_config_history(graph: CompiledGraph, config: dict) -> list:
     """
-    Returns the first configs in the state that have an AIMessage.
+    Returns the configs of the AI answers generated from the last non-AI config, oldest first.
     """
-    state_history: AsyncIterator[StateSnapshot] = graph.aget_state_history(config)
-    configs_unreversed=[]
-    
-    async for state in state_history:
-        messages = state.values.get("messages", [])
-        if messages:
-            last_message=messages[-1] #Gets the last message in the messages.
-        else:
-            break
-        if isinstance(last_message, ToolMessage): #Ignores the tool messages.
-            continue
-        if isinstance(last_message, AIMessage) and last_message.content: #Checks if the last message is an AIMessage and if it has content (a string).
-            configs_unreversed.append(state.config) #Appends the config to the configs_unreversed list.
-        else:
-            break
-        configs = list(reversed(configs_unreversed)) #Reverses the list of configs.
-    return configs
\ No newline at end of file
+    await regen_index.seed(graph, config)
+    return list(regen_index.ai_answers.get(str(config["configurable"]["thread_id"]), []))
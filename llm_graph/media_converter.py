@@ -0,0 +1,182 @@
+from concurrent.futures import ThreadPoolExecutor
+from config.config import config
+from llm_graph.files_api import ahash_content
+from utils.ttl_cache import TTLCache
+from PIL import Image, ImageOps
+from io import BytesIO
+import subprocess
+import tempfile
+import shutil
+import json
+import asyncio
+import ffmpy
+import os
+
+SUPPORTED_IMAGE_TYPES = {"image/png", "image/jpeg", "image/webp", "image/heic", "image/heif"} # Image types Gemini accepts as is.
+
+
+class MediaConverter:
+    """
+    Converts media with ffmpeg on a long-lived pool of worker threads.
+
+    GIFs are piped through ffmpeg's stdin and stdout, so nothing is written to disk. The pool is bounded
+    to the number of cores, and converted media is cached by source URL and by content hash, so the same
+    media is only converted once.
+    """
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.pool = ThreadPoolExecutor(max_workers=settings.get("workers") or os.cpu_count(), thread_name_prefix="ffmpeg")
+        self.cache = TTLCache(settings["cache_entries"]) # Content hash -> converted media.
+        self.url_hashes = TTLCache(settings["cache_entries"]) # Source URL -> content hash.
+        self.shrink_cache = TTLCache(settings["preprocess_cache_entries"]) # (Content hash, kind, limits) -> shrunk media.
+        if shutil.which("ffmpeg") is None:
+            print("ffmpeg wasn't found, so audio and video are sent without preprocessing and GIFs can't be read.")
+
+    def cached_mp4(self, url: str) -> bytes:
+        """
+        Returns the converted MP4 of the GIF at the given URL, or None if it wasn't converted yet.
+        """
+        content_hash = self.url_hashes.get(url)
+        return self.cache.get(content_hash) if content_hash else None
+
+    async def gif_to_mp4(self, gif_file, source_url: str = None) -> bytes:
+        """
+        Converts a GIF to a small MP4 without blocking the event loop.
+
+        Args:
+            gif_file (Union[bytes, IO]): The GIF to convert.
+            source_url (str): The URL the GIF was downloaded from, used as a cache key.
+        Returns:
+            bytes: The converted MP4.
+        Raises:
+            ffmpy.FFRuntimeError: If ffmpeg fails to convert the GIF.
+            ffmpy.FFExecutableNotFoundError: If ffmpeg isn't installed.
+        """
+        data = gif_file if isinstance(gif_file, bytes) else gif_file.read()
+        content_hash = await ahash_content(data)
+        if source_url:
+            self.url_hashes.put(source_url, content_hash)
+        mp4 = self.cache.get(content_hash)
+        if mp4 is None:
+            mp4 = await asyncio.get_running_loop().run_in_executor(self.pool, self._gif_to_mp4, data)
+            self.cache.put(content_hash, mp4)
+        return mp4
+
+    def _gif_to_mp4(self, data: bytes) -> bytes:
+        """
+        Synchronously converts a GIF to MP4 through ffmpeg's pipes.
+        """
+        gif = self.settings["gif"]
+        video_filter = f"fps={gif['fps']},scale='trunc(min({gif['max_width']},iw)/2)*2':-2:flags=lanczos,format=yuv420p"
+        ff = ffmpy.FFmpeg(
+            global_options="-loglevel error",
+            inputs={"pipe:0": "-f gif"},
+            # A piped MP4 can't be rewritten to move the index to the front (faststart), so a fragmented
+            # MP4 with the index at the start is written instead.
+            outputs={"pipe:1": f'-vf "{video_filter}" -c:v libx264 -preset veryfast -crf {gif["crf"]} -an -movflags frag_keyframe+empty_moov -f mp4'}
+        )
+        stdout, _ = ff.run(input_data=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return stdout
+
+    async def shrink(self, media_file, mime_type: str, limits: dict) -> tuple:
+        """
+        Re-encodes audio or video within the given limits, so it uploads, processes and tokenizes faster.
+        Audio is downmixed and resampled, video is capped in resolution, frame rate and duration, and every
+        stream the model doesn't use is dropped. The original media is returned if it can't be converted or
+        the result isn't smaller.
+
+        Args:
+            media_file (IO): The audio or video to shrink.
+            mime_type (str): The MIME type of the media.
+            limits (dict): The preprocessing limits of the guild.
+        Returns:
+            tuple: The media and its MIME type.
+        """
+        kind = mime_type.split("/")[0]
+        key = (await ahash_content(media_file), kind, json.dumps(limits, sort_keys=True)) # Different limits give different results.
+        result = self.shrink_cache.get(key)
+        if result is None:
+            try:
+                output = await asyncio.get_running_loop().run_in_executor(self.pool, self._shrink, media_file, kind, limits)
+            except (ffmpy.FFRuntimeError, ffmpy.FFExecutableNotFoundError) as e: # The original is sent instead.
+                print(f"Couldn't preprocess the {kind}: {e}")
+                output = None
+            original_size = media_file.seek(0, os.SEEK_END)
+            media_file.seek(0)
+            result = (output, "audio/ogg" if kind == "audio" else "video/mp4")
+            if not output or len(output) >= original_size: # Remembers that the original is better.
+                result = (None, mime_type)
+            self.shrink_cache.put(key, result)
+        output, output_mime_type = result
+        return (output, output_mime_type) if output else (media_file, mime_type)
+
+    def _shrink(self, media_file, kind: str, limits: dict) -> bytes:
+        """
+        Synchronously re-encodes audio or video. The input is copied to a temporary file, since containers
+        like MP4 may keep their index at the end and can't be read from a pipe; the output is piped.
+        """
+        with tempfile.NamedTemporaryFile() as temp_input:
+            shutil.copyfileobj(media_file, temp_input)
+            temp_input.flush()
+            media_file.seek(0)
+
+            audio = f"-ac {limits['audio_channels']} -ar {limits['audio_sample_rate']} -b:a {limits['audio_bitrate']}"
+            if kind == "audio":
+                output_options = f"-vn -sn -dn -map 0:a:0 -c:a libopus {audio} -f ogg"
+            else:
+                video_filter = f"fps='min({limits['max_video_fps']},source_fps)',scale=-2:'trunc(min({limits['max_video_height']},ih)/2)*2',format=yuv420p"
+                output_options = (f"-t {limits['max_video_seconds']} -map 0:v:0 -map 0:a:0? -sn -dn -vf \"{video_filter}\" "
+                                  f"-c:v libx264 -preset veryfast -crf {limits['video_crf']} -c:a aac {audio} "
+                                  "-movflags frag_keyframe+empty_moov -f mp4")
+            ff = ffmpy.FFmpeg(
+                global_options="-loglevel error",
+                inputs={temp_input.name: None},
+                outputs={"pipe:1": output_options}
+            )
+            stdout, _ = ff.run(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return stdout
+
+    async def downscale_image(self, image_file, mime_type: str) -> tuple:
+        """
+        Downscales an image to the configured maximum dimension and re-encodes it without blocking the
+        event loop. The original is kept if it's already small enough and re-encoding doesn't make it smaller.
+
+        Args:
+            image_file (Union[bytes, IO]): The image.
+            mime_type (str): The MIME type of the image.
+        Returns:
+            tuple: The image bytes and their MIME type.
+        """
+        data = image_file if isinstance(image_file, bytes) else image_file.read()
+        key = (await ahash_content(data), "image")
+        result = self.cache.get(key)
+        if result is None:
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(self.pool, self._downscale_image, data, mime_type)
+            except (OSError, Image.DecompressionBombError) as e: # Pillow raises OSError for images it can't read.
+                print(f"Couldn't downscale the image: {e}")
+                result = (data, mime_type)
+            self.cache.put(key, result)
+        return result
+
+    def _downscale_image(self, data: bytes, mime_type: str) -> tuple:
+        """
+        Synchronously downscales and re-encodes an image.
+        """
+        settings = self.settings["image"]
+        with Image.open(BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image) # Phone photos are often stored sideways with an EXIF rotation.
+            resized = max(image.size) > settings["max_dimension"]
+            image.thumbnail((settings["max_dimension"], settings["max_dimension"]), Image.Resampling.LANCZOS)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+            output = BytesIO()
+            image.save(output, format="WEBP", quality=settings["quality"], method=4)
+        if not resized and output.tell() >= len(data) and mime_type in SUPPORTED_IMAGE_TYPES:
+            return data, mime_type
+        return output.getvalue(), "image/webp"
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+media_converter = MediaConverter(config.media)
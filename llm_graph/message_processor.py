@@ -1,16 +1,46 @@
 from config.config import config
-from google import genai
-from io import BytesIO
-from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
 import discord
 from discord.ext import commands
-import ffmpy
 import aiohttp
 import asyncio
-import tempfile
+import base64
 import os
 from utils.retrieve_member import retrieve_member
+from utils.http_client import http_client
+from llm_graph.files_api import files_api_client
+from llm_graph.media_converter import media_converter
+from utils.ttl_cache import TTLCache
+import re
+
+OG_IMAGE_PATTERN = re.compile(r"<meta[^>]*og:image[\"'][^>]*>", re.IGNORECASE)
+MAX_TENOR_PAGE_CHARS = 512 * 1024 # Stops reading pages that don't have the tag in their head.
+tenor_urls = TTLCache(config.media["tenor_cache_entries"], config.media["tenor_cache_seconds"]) # Tenor page URL -> media URL.
+
+def merge_messages(processed: list) -> tuple:
+    """
+    Merges several processed messages into a single input, attributing every text part to its author.
+    A single message is returned unchanged.
+
+    Args:
+        processed (list): (MessageProcessor, (content, system prompt)) pairs, oldest first.
+    Returns:
+        tuple: The merged content list and system prompt.
+    """
+    if len(processed) == 1:
+        return processed[0][1]
+
+    merged_content = []
+    for processor, (content, _) in processed:
+        for part in content:
+            if part.get("type") == "text":
+                part = {"type": "text", "text": f"{processor.message_author.display_name}: {part['text']}"}
+            merged_content.append(part)
+
+    authors = ", ".join(dict.fromkeys(str(processor.message_author) for processor, _ in processed))
+    system_prompt = f"{processed[-1][0].sys_prompt}. Several messages were sent at once by {authors}. Answer all of them in a single reply."
+    return merged_content, system_prompt
+
 
 class MessageProcessor:
     """
@@ -20,228 +50,203 @@ class MessageProcessor:
     """
     def __init__(self, message: discord.Message, bot: commands.Bot):
         self.sys_prompt = ""
-        self.downloaded_attachment = None
         self.message = message
 
         self.attachments = message.attachments
-        self.att_type = self.attachments[-1].content_type if self.attachments else ""
-        self.att_url = self.attachments[-1].url if self.attachments else ""
         self.message_content = message.content
         self.message_author = message.author
         self.bot = bot
 
-    async def process_message(self) -> str:
+    async def process_message(self) -> tuple:
         """
         Processes the given message. 
 
-        Can process images, audio and text, and then sends the output.
+        Can process images, audio, video, GIFs and text. Every attachment is processed at the same time,
+        and the results are combined into a single multimodal input.
+
+        Returns:
+            tuple: The content list and the system prompt.
         """
         bot_member: discord.Member = await retrieve_member(self.message, self.bot.user.id)
         bot_name = bot_member.display_name
         self.sys_prompt = await config.initialize_system_prompt(self.message.guild, bot_name)
 
-        processing_methods={ # This dictionary allows for easy implementation of other processing methods.
-            "image": self._process_image,
-            "audio": self._process_audio,
-            "video": self._process_video,
-            #"gif": self._process_gif, unused dict entry
-            "": self._process_text # If att_type is empty then this is the default.
-        }
-        
+        media = [(attachment.url, attachment.content_type or "") for attachment in self.attachments]
+        if self._is_gif_link():
+            media.append((self.message_content, "image/gif"))
 
-        if self.att_url:
-            self.downloaded_attachment = await self._download_attachment(self.att_url)
-        result = await self._determine_message_type(processing_methods)
-        return result
+        limit = asyncio.Semaphore(config.media["max_parallel_attachments"]) # Per message, so one message can't take every connection.
+        async with self.message.channel.typing():
+            results = await asyncio.gather(*(self._process_media(url, content_type, limit) for url, content_type in media),
+                                           return_exceptions=True)
+
+        content = [{"type": "text", "text": "" if self._is_gif_link() else self.message_content}]
+        descriptions = []
+        for (url, _), result in zip(media, results):
+            if isinstance(result, BaseException): # A broken attachment doesn't drop the rest of the message.
+                print(f"Error processing {url}: {result!r}")
+                continue
+            parts, description = result
+            content.extend(parts)
+            descriptions.append(description)
+
+        sent = ", ".join(descriptions) if descriptions else "a text message"
+        return content, f"{self.sys_prompt}. A user called {self.message_author} sent {sent}."
+
+    def _is_gif_link(self) -> bool:
+        """
+        Returns True if the message's text is a link to a GIF.
+        """
+        if self.message_content.startswith("https://") and self.message_content.endswith(".gif"):
+            return True
+        return self.message_content.startswith("https://tenor.com/") and "gif" in self.message_content
 
-    async def _determine_message_type(self, processing_methods: dict) -> str:
-        """.
-        Determines if the message is an image, audio, or text and processes it accordingly.
+    async def _process_media(self, url: str, content_type: str, limit: asyncio.Semaphore) -> tuple:
+        """
+        Determines if the media is an image, audio, video or GIF and processes it accordingly.
 
         Args:
-            processing_methods (dict): A dictionary mapping attachment types to processing methods.
+            url (str): The URL of the media.
+            content_type (str): The MIME type of the media.
+            limit (asyncio.Semaphore): Limits how many media of the message are processed at once.
         Returns:
-            str: The result of the corresponding processing method.
+            tuple: The content parts of the media and a description of it for the system prompt.
         """
-        if self.message_content.startswith("https://") and self.message_content.endswith(".gif"):
-            result = await self._process_gif()
-            return result
-        if self.message_content.startswith("https://tenor.com/") and "gif" in self.message_content:
-            result = await self._process_gif()
-            return result
-        if self.att_type.endswith("gif"):
-            result = await self._process_gif()
-            return result
+        processing_methods={ # This dictionary allows for easy implementation of other processing methods.
+            "image/gif": self._process_gif, # Checked before the other images.
+            "image": self._process_image,
+            "audio": self._process_audio,
+            "video": self._process_video,
+        }
         for prefix, method in processing_methods.items():
-            if self.att_type.startswith(prefix):
-                result = await method() # Calls the corresponding method.
-                return result
+            if content_type.startswith(prefix):
+                async with limit:
+                    return await method(url, content_type) # Calls the corresponding method.
+        raise ValueError(f"Unsupported attachment type: {content_type or 'unknown'}")
             
     async def _download_attachment(self, url: str):
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if "discordapp" in url:
-                        content_type = response.headers.get('Content-Type', '')
-                        # Check if the response is actually media and not HTML
-                        text_content = ""
-                        if 'text/plain' in content_type and response.status == 404: # Check if the response has a text response.
-                            text_content = await response.text()
-                            if "This content is no longer available." in text_content: # Check if the response is this string.
-
-                                # Fix the URL using hyonsu's API.
-                                if "cdn.discordapp.com" in url:
-                                    alt_url = url.replace("cdn.discordapp.com", "fixcdn.hyonsu.com")
-                                elif "media.discordapp.net" in url:
-                                    alt_url = url.replace("media.discordapp.net", "fixcdn.hyonsu.com")
-                                else:
-                                    raise NotImplementedError(f"Discord CDN not implemented: {url}")
-                                # Get a response from the alternate URL.
-                                async with session.get(alt_url) as alt_response:
-                                    return await alt_response.read()
-                        elif response.status == 200:
-                            return await response.read()
-                        else:
-                            response.raise_for_status()
-                    elif "tenor" in url:
-                        soup = BeautifulSoup(await response.text(), 'html.parser')
-                        media_url = None
-                        og_image_meta = soup.find('meta', property='og:image')
-
-                        if og_image_meta and og_image_meta.get('content'):
-                            media_url = og_image_meta['content']
-                        async with aiohttp.ClientSession() as session:
-                            async with session.get(media_url) as response:
-                                return await response.read()
-
-    async def _process_image(self) -> str:
         """
-        Processes the image.
+        Downloads the media at the given URL through the shared HTTP client. Tenor pages are resolved to
+        their media first, and expired Discord CDN links are retried through hyonsu's API.
 
         Returns:
-            str: The output of the LLM's processing of the image.
+            SpooledTemporaryFile: The downloaded media.
         """
-        async with self.message.channel.typing():
-            image_messages=([
-                {"type": "text", "text": self.message_content},
-                {"type": "image_url", "image_url": self.att_url}
-                ], 
-                self.sys_prompt)
-        return image_messages
+        if "tenor" in url:
+            url = await self._resolve_tenor_url(url)
+        try:
+            return await http_client.download(url)
+        except aiohttp.ClientResponseError as e:
+            if e.status != 404 or "discordapp" not in url:
+                raise
+            # The content is no longer available, fix the URL using hyonsu's API.
+            if "cdn.discordapp.com" in url:
+                alt_url = url.replace("cdn.discordapp.com", "fixcdn.hyonsu.com")
+            elif "media.discordapp.net" in url:
+                alt_url = url.replace("media.discordapp.net", "fixcdn.hyonsu.com")
+            else:
+                raise NotImplementedError(f"Discord CDN not implemented: {url}")
+            # Get a response from the alternate URL.
+            return await http_client.download(alt_url)
+
+    async def _resolve_tenor_url(self, url: str) -> str:
+        """
+        Returns the URL of the media shown in the given Tenor page. Resolved pages are cached, and the page
+        is only read until its og:image meta tag.
+        """
+        media_url = tenor_urls.get(url)
+        if media_url:
+            return media_url
+
+        page, meta_tag = "", None
+        async with http_client.session.get(url) as response:
+            async for chunk in response.content.iter_chunked(16 * 1024):
+                page += chunk.decode("utf-8", errors="ignore")
+                meta_tag = OG_IMAGE_PATTERN.search(page)
+                if meta_tag or "</head>" in page or len(page) > MAX_TENOR_PAGE_CHARS:
+                    break
+        if not meta_tag:
+            return None
+
+        og_image_meta = BeautifulSoup(meta_tag.group(0), 'html.parser').find('meta') # Only the tag is parsed.
+        if og_image_meta and og_image_meta.get('content'):
+            media_url = og_image_meta['content']
+            tenor_urls.put(url, media_url)
+        return media_url
 
-    async def _process_audio(self) -> str:
+    async def _process_image(self, url: str, content_type: str) -> tuple:
         """
-        Processes the audio.
+        Processes the image.
 
         Returns:
-            str: The output of the LLM's processing of the image.
+            tuple: The content parts of the image and its description.
         """
-        myfile = await self._upload_to_files_api(self.downloaded_attachment)
-
-        async with self.message.channel.typing():
-            audio_messages=([{"type": "text", "text": self.message_content},
-                            {"type": "media", "mime_type": self.att_type, "file_uri": myfile.uri}],
-                            f"{self.sys_prompt}. A user called {self.message_author} sent an audio file.")
-        return audio_messages
+        image, mime_type = await media_converter.downscale_image(await self._download_attachment(url), content_type)
+        if len(image) > config.media["inline_max_bytes"]: # Big images are uploaded, so the thread only stores their reference.
+            return [await self._media_part(image, mime_type)], "an image"
+        data_url = f"data:{mime_type};base64,{base64.b64encode(image).decode()}" # Sent inline, so the model doesn't fetch the CDN link.
+        return [{"type": "image_url", "image_url": data_url}], "an image"
 
-    async def _process_text(self) -> str:
+    async def _process_audio(self, url: str, content_type: str) -> tuple:
         """
-        Processes the text given.
+        Processes the audio.
 
         Returns:
-            str: The output of the LLM's processing of the text.
+            tuple: The content parts of the audio and its description.
         """
-        async with self.message.channel.typing():
-                text_messages=([{
-                    "type": "text",
-                    "text": self.message_content
-                }], 
-                f"{self.sys_prompt}. A user called {self.message_author} sent a text message.")
-        return text_messages
-    
-    async def _process_video(self) -> str:
+        media_content = await self._download_attachment(url)
+        limits = config.media_limits(self.message.guild)
+        if limits["enabled"]:
+            media_content, content_type = await media_converter.shrink(media_content, content_type, limits)
+        return [await self._media_part(media_content, content_type)], "an audio file"
+
+    async def _process_video(self, url: str, content_type: str) -> tuple:
         """
         Process the video given.
 
         Returns:
-            str: The processed video.
+            tuple: The content parts of the video and its description.
         """
+        media_content = await self._download_attachment(url)
+        limits = config.media_limits(self.message.guild)
+        if limits["enabled"]:
+            media_content, content_type = await media_converter.shrink(media_content, content_type, limits)
+        return [await self._media_part(media_content, content_type)], "a video"
 
-        myfile = self._upload_to_files_api(self.downloaded_attachment)
-        
+    async def _process_gif(self, url: str, content_type: str) -> tuple:
+        # Conversion: gif -> mp4, skipping the download if this GIF was already converted.
+        media_content = media_converter.cached_mp4(url)
+        if media_content is None:
+            media_content = await media_converter.gif_to_mp4(await self._download_attachment(url), url)
 
-        async with self.message.channel.typing():
-            video_messages=([{"type": "text", "text": self.message_content},
-                            {"type": "media", "mime_type": self.att_type, "file_uri": myfile.uri}],
-                            f"{self.sys_prompt}. A user called {self.message_author} sent a video.")
-        return video_messages
-    
-    async def _process_gif(self) -> tuple:
-        # Get the downloaded gif.
-        self.downloaded_attachment = await self._download_attachment(self.message_content)
-
-        # Conversion: gif -> mp4
-        with ThreadPoolExecutor() as pool:
-            mp4_content = await asyncio.get_event_loop().run_in_executor(
-                pool,
-                lambda: self.convert_gif_to_mp4(self.downloaded_attachment)
-            )
-            media_content = mp4_content
-    
-        myfile = await self._upload_to_files_api(media_content, gif=True)
-        # Return the processed message.
-        async with self.message.channel.typing():
-            gif_messages=([{"type": "text", "text": f""},
-                            {"type": "media", "mime_type": "video/mp4", "file_uri": myfile.uri}],
-                            f"{self.sys_prompt}. A user called {self.message_author} sent a GIF in the form of a video.")
-        return gif_messages
-    
-    def convert_gif_to_mp4(self, content_bytes):
-        """
-        Synchronously converts gif bytes to MP4.
+        return [await self._media_part(media_content, "video/mp4")], "a GIF in the form of a video"
+
+    async def _media_part(self, media_content, mime_type: str) -> dict:
         """
-        
-        with tempfile.NamedTemporaryFile(suffix=".gif", delete=False) as temp_input:
-            temp_input.write(content_bytes)
-            temp_input_path = temp_input.name
+        Returns the content part for the given media. Media up to the inline size limit is sent inline as
+        base64, which skips the upload and processing of the Files API. Bigger media is uploaded.
 
-        with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as temp_output:
-            temp_output_path = temp_output.name
+        Args:
+            media_content (Union[bytes, IO]): The media.
+            mime_type (str): The MIME type of the media.
+        Returns:
+            dict: The media content part.
+        """
+        if isinstance(media_content, bytes):
+            size = len(media_content)
+        else:
+            size = media_content.seek(0, os.SEEK_END)
+            media_content.seek(0)
+        if size <= config.media["inline_max_bytes"]:
+            data = media_content if isinstance(media_content, bytes) else media_content.read()
+            return {"type": "media", "mime_type": mime_type, "data": base64.b64encode(data).decode()}
+        return {"type": "media", "mime_type": mime_type, "file_uri": await self._upload_to_files_api(media_content, mime_type)}
+
+    async def _upload_to_files_api(self, media_content, mime_type: str) -> str:
+        """
+        Uploads the media to the Files API through the shared client.
 
-        try:
-            ff = ffmpy.FFmpeg(
-                inputs={temp_input_path: "-f gif"},
-                outputs={temp_output_path: '-y'}
-            )            
-            # Execute the conversion
-            ff.run()
-
-            with open(temp_output_path, "rb") as file:
-                output_bytes = file.read()
-            return  output_bytes
-        except Exception as e:
-            print(f"Error during conversion: {e}")
-            return None
-        finally:
-            if os.path.exists(temp_input_path):
-                os.unlink(temp_input_path)
-            if os.path.exists(temp_output_path):
-                os.unlink(temp_output_path)
-
-    async def _upload_to_files_api(self, media_content, gif: bool = False):
-        file_data = BytesIO(media_content)
-        client = genai.Client()
-                # Upload to the Files API.
-        mime_type = self.att_type if not gif else "video/mp4"
-        myfile = await asyncio.get_event_loop().run_in_executor(
-            None,
-            lambda: client.files.upload(file=file_data, config={"mime_type": mime_type})
-        )
-        # Wait for processing.
-        while myfile.state.name == "PROCESSING":
-            print("processing video...")
-            await asyncio.sleep(5)
-            myfile = await asyncio.get_event_loop().run_in_executor(
-            None,
-            lambda: client.files.get(name=myfile.name)
-        )
-        return myfile
\ No newline at end of file
+        Returns:
+            str: The URI of the uploaded file.
+        """
+        return await files_api_client.upload(media_content, mime_type)
@@ -0,0 +1,26 @@
+from langchain_core.messages import HumanMessage, SystemMessage
+
+
+def with_instruction(instruction: str, conversation: list, system_instruction: bool = True) -> list:
+    """
+    Puts the instruction in front of the conversation. Models that take a system instruction get it as a
+    leading SystemMessage. For the others, like Gemma, it's put at the start of the first HumanMessage,
+    since the API rejects their system instructions.
+
+    Args:
+        instruction (str): The instruction. Empty if there's none.
+        conversation (list): The messages, without SystemMessages.
+        system_instruction (bool): Whether the model accepts system instructions.
+    Returns:
+        list: The messages to send.
+    """
+    if not instruction:
+        return conversation
+    if system_instruction:
+        return [SystemMessage(content=instruction), *conversation]
+    for i, message in enumerate(conversation):
+        if isinstance(message, HumanMessage):
+            content = (f"{instruction}\n\n{message.content}" if isinstance(message.content, str)
+                       else [{"type": "text", "text": instruction}, *message.content])
+            return [*conversation[:i], message.model_copy(update={"content": content}), *conversation[i + 1:]]
+    return [HumanMessage(content=instruction), *conversation]
@@ -0,0 +1,60 @@
+from contextlib import asynccontextmanager
+from config.config import config
+import asyncio
+
+
+class ConversationScheduler:
+    """
+    Schedules the work done for every conversation thread.
+
+    Work on the same thread runs one at a time and in arrival order, while different threads run in
+    parallel up to a global concurrency limit.
+    """
+    def __init__(self, max_concurrency: int):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._locks: dict[str, asyncio.Lock] = {} # Thread ID -> ordering lock.
+        self._users: dict[str, int] = {} # Thread ID -> number of tasks holding or waiting for the lock.
+        self._pending: dict[str, list] = {} # Thread ID -> items waiting to be answered, oldest first.
+
+    @asynccontextmanager
+    async def slot(self, thread_id: str):
+        """
+        Waits for the thread's turn and for a free concurrency slot.
+
+        Args:
+            thread_id (str): The thread the work belongs to.
+        """
+        lock = self._locks.setdefault(thread_id, asyncio.Lock()) # asyncio.Lock wakes up its waiters in FIFO order.
+        self._users[thread_id] = self._users.get(thread_id, 0) + 1
+        try:
+            async with lock, self._semaphore:
+                yield
+        finally:
+            self._users[thread_id] -= 1
+            if not self._users[thread_id]: # Nobody else is waiting, so the lock can be dropped.
+                del self._users[thread_id]
+                del self._locks[thread_id]
+
+    def enqueue(self, thread_id: str, item) -> None:
+        """
+        Adds an item to the thread's queue of items waiting to be answered.
+        """
+        self._pending.setdefault(thread_id, []).append(item)
+
+    def take_pending(self, thread_id: str, limit: int) -> list:
+        """
+        Removes and returns up to the given number of the thread's oldest waiting items.
+        """
+        pending = self._pending.get(thread_id, [])
+        taken, self._pending[thread_id] = pending[:limit], pending[limit:]
+        if not self._pending[thread_id]:
+            del self._pending[thread_id]
+        return taken
+
+    def is_busy(self, thread_id: str) -> bool:
+        """
+        Returns whether any work is running or waiting on the given thread.
+        """
+        return thread_id in self._users
+
+scheduler = ConversationScheduler(config.max_concurrent_generations)
@@ -0,0 +1,204 @@
+from langchain_core.messages import ToolMessage
+from langchain_core.tools import tool
+from urllib.parse import urlsplit
+from utils.http_client import http_client
+from utils.ttl_cache import TTLCache
+from bs4 import BeautifulSoup
+from config.config import config
+import aiohttp
+import asyncio
+import json
+import os
+
+
+def normalize_query(query: str) -> str:
+    """
+    Returns the cache key of a query, so queries that only differ in case or spacing share their results.
+    """
+    return " ".join(query.lower().split())
+
+
+class SearxClient:
+    """
+    Asynchronous SearXNG client that shares the pooled HTTP session.
+
+    Results are cached by normalized query for a few minutes, so the same question asked in several
+    guilds only reaches SearXNG once.
+    """
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.cache = TTLCache(settings["cache_entries"], settings["cache_seconds"]) # Normalized query -> results.
+
+    @property
+    def host(self) -> str:
+        return os.getenv("SEARXNG_HOST", "http://localhost:32787")
+
+    async def search(self, query: str) -> list:
+        """
+        Searches the query in SearXNG.
+
+        Args:
+            query (str): The search query.
+        Returns:
+            list: The results, each with its snippet, title, link, engines and category.
+        Raises:
+            aiohttp.ClientError: If SearXNG can't be reached or answers with an error.
+        """
+        key = normalize_query(query)
+        results = self.cache.get(key)
+        if results is not None:
+            return results
+
+        params = {"q": query, "format": "json"}
+        timeout = aiohttp.ClientTimeout(total=self.settings["timeout_seconds"])
+        async with http_client.session.get(f"{self.host}/search", params=params, timeout=timeout) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+
+        results = [{
+            "snippet": result.get("content", ""),
+            "title": result.get("title", ""),
+            "link": result.get("url", ""),
+            "engines": result.get("engines", []),
+            "category": result.get("category", ""),
+        } for result in data.get("results", [])[:self.settings["num_results"]]]
+        self.cache.put(key, results)
+        return results
+
+searx_client = SearxClient(config.search)
+
+
+def compact_results(results: list, settings: dict) -> list:
+    """
+    Shrinks search results before they're stored in the conversation. Repeated URLs are dropped, each
+    domain keeps only its first few results, snippets are truncated and fields the model doesn't use
+    (engines, category) are removed.
+
+    Args:
+        results (list): The results of a search.
+        settings (dict): The compaction settings.
+    Returns:
+        list: The compacted results, with their title, link and snippet.
+    """
+    compacted = []
+    seen_urls = set()
+    domain_counts = {}
+    for result in results:
+        parts = urlsplit(result["link"])
+        url_key = (parts.netloc.lower().removeprefix("www."), parts.path.rstrip("/"), parts.query) # Ignores the scheme and fragment.
+        domain = url_key[0]
+        if url_key in seen_urls or domain_counts.get(domain, 0) >= settings["max_per_domain"]:
+            continue
+        seen_urls.add(url_key)
+        domain_counts[domain] = domain_counts.get(domain, 0) + 1
+
+        snippet = " ".join(result["snippet"].split())
+        if len(snippet) > settings["snippet_chars"]:
+            snippet = snippet[:settings["snippet_chars"]].rsplit(" ", 1)[0] + "…"
+        compacted.append({"title": result["title"], "link": result["link"], "snippet": snippet})
+    return compacted
+
+def compact_tool_message(message: ToolMessage) -> ToolMessage:
+    """
+    Replaces the content of a search ToolMessage with its compacted results and drops the raw results it
+    carries, so only the compact version is checkpointed. Other messages are returned unchanged.
+    """
+    if not isinstance(message, ToolMessage) or message.name != searx_tool.name or not isinstance(message.artifact, list):
+        return message
+    compacted = compact_results(message.artifact, config.search["compaction"])
+    return message.model_copy(update={"content": json.dumps(compacted, ensure_ascii=False), "artifact": None})
+
+
+@tool("searx_search_results", response_format="content_and_artifact")
+async def searx_tool(query: str) -> tuple:
+    """
+    A meta search engine. Useful for when you need to answer questions about current events. Input should
+    be a search query. Output is a JSON array of the query results.
+    """
+    results = await searx_client.search(query)
+    return str(results), results # The raw results are compacted by the graph before they're stored.
+
+
+class PageReader:
+    """
+    Fetches result pages concurrently through the pooled HTTP session and extracts their readable text.
+
+    Every fetch has its own timeout and size cap, only HTML pages are read, and the extracted text is
+    cached by URL for a while.
+    """
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.cache = TTLCache(settings["cache_entries"], settings["cache_seconds"]) # URL -> extracted text.
+
+    async def read_pages(self, urls: list) -> list:
+        """
+        Returns the text of every page, or None for the pages that couldn't be read.
+        """
+        results = await asyncio.gather(*(self.read_page(url) for url in urls), return_exceptions=True)
+        texts = []
+        for url, result in zip(urls, results):
+            if isinstance(result, BaseException):
+                print(f"Couldn't read {url}: {result!r}")
+                result = None
+            texts.append(result)
+        return texts
+
+    async def read_page(self, url: str) -> str:
+        """
+        Returns the readable text of the page at the given URL, truncated to the configured length.
+        """
+        text = self.cache.get(url)
+        if text is not None:
+            return text
+
+        html = await self._fetch_html(url)
+        text = await asyncio.get_running_loop().run_in_executor(None, self._extract_text, html) if html else ""
+        self.cache.put(url, text)
+        return text
+
+    async def _fetch_html(self, url: str) -> str:
+        """
+        Downloads a page, stopping at the size cap. Returns None if the page isn't HTML.
+        """
+        timeout = aiohttp.ClientTimeout(total=self.settings["timeout_seconds"])
+        async with http_client.session.get(url, timeout=timeout) as response:
+            response.raise_for_status()
+            if response.content_type not in ("text/html", "application/xhtml+xml"):
+                return None
+            body = bytearray()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                body += chunk
+                if len(body) >= self.settings["max_page_bytes"]: # A truncated page still has most of its text.
+                    break
+            return body[:self.settings["max_page_bytes"]].decode(response.charset or "utf-8", errors="replace")
+
+    def _extract_text(self, html: str) -> str:
+        """
+        Synchronously extracts the readable text of a page, without scripts, styles and navigation.
+        """
+        soup = BeautifulSoup(html, 'html.parser')
+        for element in soup(["script", "style", "noscript", "template", "svg", "nav", "header", "footer", "aside", "form"]):
+            element.decompose()
+        text = " ".join(soup.get_text(" ").split())
+        if len(text) > self.settings["page_chars"]:
+            text = text[:self.settings["page_chars"]].rsplit(" ", 1)[0] + "…"
+        return text
+
+page_reader = PageReader(config.search["deep_search"])
+
+
+@tool("deep_search")
+async def deep_search_tool(query: str) -> str:
+    """
+    Searches the web and reads the top result pages. Slower than searx_search_results, use it when the
+    snippets aren't enough to answer. Input should be a search query. Output is a JSON array with the
+    title, link and text of the top pages.
+    """
+    settings = config.search["deep_search"]
+    results = compact_results(await searx_client.search(query), config.search["compaction"])[:settings["pages"]]
+    texts = await page_reader.read_pages([result["link"] for result in results])
+    pages = [{"title": result["title"], "link": result["link"], "text": text or result["snippet"]} # Falls back to the snippet.
+             for result, text in zip(results, texts)]
+    return json.dumps(pages, ensure_ascii=False)
+
+search_tools = [searx_tool, deep_search_tool] if config.search["deep_search"]["enabled"] else [searx_tool] # The tools given to the LLM.
@@ -0,0 +1,95 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage, BaseMessage
+from langchain_core.language_models import BaseChatModel
+from langgraph.constants import TAG_NOSTREAM
+from llm_graph.prompt import with_instruction
+
+
+def messages_to_fold(messages: list, token_counts: dict, settings: dict) -> list:
+    """
+    Returns the oldest messages that should be folded into the summary, or an empty list if the thread is
+    still under the threshold.
+
+    Messages are only folded up to the start of a turn (a HumanMessage), so a tool call is never separated
+    from its result, and the turn being answered is never folded.
+
+    Args:
+        messages (list): The messages in the state.
+        token_counts (dict): The token count of every message, keyed by message ID.
+        settings (dict): The summarization settings.
+    Returns:
+        list: The messages to fold, oldest first.
+    """
+    total_tokens = sum(token_counts[message.id] for message in messages)
+    if total_tokens <= settings["trigger_tokens"]:
+        return []
+
+    turn_starts = [i for i, message in enumerate(messages) if isinstance(message, HumanMessage) and i > 0]
+    if not turn_starts:
+        return []
+    cut = turn_starts[-1] # At most, everything before the current turn is folded.
+    turn_starts = set(turn_starts)
+    kept_tokens = total_tokens
+    for i, message in enumerate(messages):
+        if kept_tokens <= settings["keep_tokens"] and i in turn_starts:
+            cut = i
+            break
+        kept_tokens -= token_counts[message.id]
+    return messages[:cut]
+
+
+def render_message(message: BaseMessage) -> str:
+    """
+    Returns a plain-text line for the message to be summarized. System prompts are skipped and media is
+    replaced by a placeholder.
+    """
+    if isinstance(message, SystemMessage):
+        return ""
+    if isinstance(message, ToolMessage):
+        return f"Search results: {_content_text(message.content)[:500]}"
+    if isinstance(message, AIMessage) and message.tool_calls:
+        return "Assistant searched for: " + ", ".join(str(tool_call["args"]) for tool_call in message.tool_calls)
+    role = "Assistant" if isinstance(message, AIMessage) else "User"
+    return f"{role}: {_content_text(message.content)}"
+
+def _content_text(content) -> str:
+    """
+    Joins the text of a message's content, whether it's a string, the chunks of an answer or content parts.
+    """
+    if isinstance(content, str):
+        return content
+    texts = []
+    for part in content:
+        if isinstance(part, str):
+            texts.append(part)
+        elif part.get("type") == "text":
+            texts.append(part.get("text", ""))
+        elif part.get("type") == "image_url":
+            texts.append("[image]")
+        elif part.get("type") == "media":
+            texts.append(f"[{part.get('mime_type', 'media').split('/')[0]}]")
+    return " ".join(text for text in texts if text)
+
+
+async def summarize(llm: BaseChatModel, summary: str, messages: list, settings: dict, system_instruction: bool = True) -> str:
+    """
+    Folds the given messages into the summary of the conversation.
+
+    Args:
+        llm (BaseChatModel): The model that writes the summary.
+        summary (str): The current summary. Empty if there's none yet.
+        messages (list): The messages to fold, oldest first.
+        settings (dict): The summarization settings.
+        system_instruction (bool): Whether the model accepts system instructions.
+    Returns:
+        str: The updated summary.
+    """
+    rendered = "\n".join(line for line in map(render_message, messages) if line)
+    prompt = with_instruction(
+        "You keep a running summary of a Discord conversation. Update the summary with the new messages. "
+        "Keep who said what, facts, decisions, open questions and the users' preferences. "
+        f"Answer with the summary only, in at most {settings['max_summary_words']} words.",
+        [HumanMessage(content=f"Current summary:\n{summary or 'None.'}\n\nNew messages:\n{rendered}")],
+        system_instruction
+    )
+    response = await llm.with_config(tags=[TAG_NOSTREAM]).ainvoke(prompt) # The summary isn't streamed to Discord.
+    return response.text()
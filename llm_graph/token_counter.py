@@ -0,0 +1,167 @@
+from langchain_core.messages import BaseMessage, ToolMessage
+from PIL import Image
+from io import BytesIO
+import base64
+import json
+import math
+
+CHARS_PER_TOKEN = 4 # Rough average for English text with Gemini's tokenizer.
+MESSAGE_OVERHEAD = 4 # Tokens spent on the role and separators of every message.
+MEDIA_TOKENS = { # Flat estimates for media parts whose duration and size aren't known.
+    "image": 258,
+    "audio": 960, # About 30 seconds at 32 tokens per second.
+    "video": 2630, # About 10 seconds at 263 tokens per second.
+}
+TOKENS_PER_SECOND = {"audio": 32, "video": 263} # Video is sampled at one frame per second, plus its audio.
+IMAGE_HEADER_CHARS = 64 * 1024 # Base64 characters decoded to read an inline image's size. A multiple of 4.
+IMAGE_TILE_SIZE = 768 # Images bigger than 384 pixels are split in tiles of this size, each counted like a small image.
+TOOL_OUTPUT_WEIGHT = 1.5 # JSON, links and truncated snippets take more tokens per character than prose.
+
+
+def estimate_text_tokens(text: str) -> int:
+    """
+    Estimates the token count of the given text without calling the API.
+    ASCII characters are counted in groups of four and any other character counts as a whole token.
+
+    Args:
+        text (str): The text to estimate.
+    Returns:
+        int: The estimated token count.
+    """
+    ascii_chars = sum(1 for char in text if char.isascii())
+    return math.ceil(ascii_chars / CHARS_PER_TOKEN) + (len(text) - ascii_chars)
+
+
+def _estimate_part_tokens(part, media_limits: dict = None) -> int:
+    """
+    Estimates the token count of a single content part.
+    """
+    if isinstance(part, str):
+        return estimate_text_tokens(part)
+    part_type = part.get("type", "")
+    if part_type == "text":
+        return estimate_text_tokens(part.get("text", ""))
+    if part_type == "image_url":
+        return _estimate_image_tokens(part["image_url"])
+    if part_type == "media":
+        return _estimate_media_tokens(part, media_limits)
+    return estimate_text_tokens(json.dumps(part, default=str))
+
+
+def _bitrate(value) -> int:
+    """
+    Returns the bits per second of an ffmpeg bitrate like "32k".
+    """
+    value = str(value).lower()
+    multipliers = {"k": 1000, "m": 1000000}
+    return int(float(value[:-1]) * multipliers[value[-1]]) if value[-1] in multipliers else int(value)
+
+
+def _estimate_media_tokens(part: dict, media_limits: dict = None) -> int:
+    """
+    Estimates the token count of an audio or video part from its duration. Inline media's duration is
+    worked out from its size and the preprocessing bitrate, and uploaded video is assumed to be as long as
+    the guild's limit allows. Without the guild's limits, or for uploaded audio, the flat estimates are used.
+    """
+    kind = part.get("mime_type", "").split("/")[0]
+    if kind not in TOKENS_PER_SECOND or media_limits is None:
+        return MEDIA_TOKENS.get(kind, MEDIA_TOKENS["video"])
+    if "data" in part:
+        bitrate = media_limits["audio_bitrate"] if kind == "audio" else media_limits["expected_video_bitrate"]
+        seconds = len(part["data"]) * 3 / 4 * 8 / _bitrate(bitrate)
+        if kind == "video":
+            seconds = min(seconds, media_limits["max_video_seconds"])
+        return math.ceil(seconds * TOKENS_PER_SECOND[kind])
+    if kind == "video":
+        return media_limits["max_video_seconds"] * TOKENS_PER_SECOND["video"]
+    return MEDIA_TOKENS["audio"]
+
+
+def _estimate_image_tokens(image_url) -> int:
+    """
+    Estimates the token count of an image. Inline images are counted by their tiles, reading their size
+    from the start of the data only. Linked and uploaded images use the flat estimate.
+    """
+    url = image_url.get("url", "") if isinstance(image_url, dict) else image_url
+    if not url.startswith("data:"):
+        return MEDIA_TOKENS["image"]
+    try:
+        head = base64.b64decode(url.split(",", 1)[1][:IMAGE_HEADER_CHARS])
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP": # Pillow needs the whole file to open a WebP.
+            width, height = _webp_size(head)
+        else:
+            with Image.open(BytesIO(head)) as image: # Pillow only reads the header to get the size.
+                width, height = image.size
+    except (OSError, ValueError, IndexError):
+        return MEDIA_TOKENS["image"]
+    if width <= IMAGE_TILE_SIZE // 2 and height <= IMAGE_TILE_SIZE // 2:
+        return MEDIA_TOKENS["image"]
+    return MEDIA_TOKENS["image"] * math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE)
+
+
+def _webp_size(head: bytes) -> tuple:
+    """
+    Reads the size of a WebP image from the first bytes of the file.
+    """
+    chunk = head[12:16]
+    if chunk == b"VP8X": # Extended format, e.g. with transparency: 24-bit sizes minus one.
+        return 1 + int.from_bytes(head[24:27], "little"), 1 + int.from_bytes(head[27:30], "little")
+    if chunk == b"VP8L": # Lossless: 14-bit sizes minus one, packed after the signature byte.
+        bits = int.from_bytes(head[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8 ": # Lossy: 14-bit sizes after the frame tag and start code.
+        return int.from_bytes(head[26:28], "little") & 0x3FFF, int.from_bytes(head[28:30], "little") & 0x3FFF
+    raise ValueError("Unknown WebP chunk.")
+
+
+def estimate_tokens(message: BaseMessage, media_limits: dict = None) -> int:
+    """
+    Estimates the token count of a message, including its content parts and tool calls.
+
+    Args:
+        message (BaseMessage): The message to estimate.
+        media_limits (dict): The media preprocessing limits of the guild, used to estimate audio and
+            video from their duration. Flat estimates are used without them.
+    Returns:
+        int: The estimated token count.
+    """
+    content = message.content if isinstance(message.content, list) else [message.content]
+    content_tokens = sum(_estimate_part_tokens(part, media_limits) for part in content)
+    if isinstance(message, ToolMessage):
+        content_tokens = math.ceil(content_tokens * TOOL_OUTPUT_WEIGHT)
+    tokens = MESSAGE_OVERHEAD + content_tokens
+    for tool_call in getattr(message, "tool_calls", []):
+        tokens += estimate_text_tokens(json.dumps(tool_call.get("args", {}), default=str))
+    return tokens
+
+
+def truncate_tool_message(message: ToolMessage, max_tokens: int) -> ToolMessage:
+    """
+    Returns a copy of the tool message cut down to about the given token count, keeping the start of its
+    content. The copy keeps the message's ID, so it still answers its tool call.
+
+    Args:
+        message (ToolMessage): The tool message to truncate.
+        max_tokens (int): The most tokens the copy should take.
+    Returns:
+        ToolMessage: The truncated copy, or the message itself if it already fits.
+    """
+    if estimate_tokens(message) <= max_tokens:
+        return message
+    text = message.content if isinstance(message.content, str) else json.dumps(message.content, default=str)
+    marker = " [truncated]"
+    chars = max(int((max_tokens - MESSAGE_OVERHEAD) * CHARS_PER_TOKEN / TOOL_OUTPUT_WEIGHT) - len(marker), 0)
+    truncated = message.model_copy(update={"content": text[:chars] + marker})
+    while chars > 0 and estimate_tokens(truncated) > max_tokens: # Non-ASCII text takes more tokens per character.
+        chars = chars * max_tokens // estimate_tokens(truncated)
+        truncated = message.model_copy(update={"content": text[:chars] + marker})
+    return truncated
+
+
+def merge_token_counts(left: dict, right: dict) -> dict:
+    """
+    Reducer for the token counts stored in the state. New counts are added to the existing ones,
+    and counts set to None are removed.
+    """
+    merged = {**left, **right}
+    return {message_id: count for message_id, count in merged.items() if count is not None}
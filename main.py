@@ -6,6 +6,9 @@ from dotenv import load_dotenv
 from entry_point import entry_point
 from utils.validation import validate_message
 from config.config import config
+from llm_graph.graph import graph
+from utils.http_client import http_client
+from llm_graph.media_converter import media_converter
 
 load_dotenv()
 
@@ -13,7 +16,23 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-bot = commands.Bot(command_prefix="", intents=intents, help_command=None)
+class Tauleph(commands.Bot):
+    async def setup_hook(self):
+        """
+        Prepares the resources that need a running event loop before the bot connects.
+        """
+        await graph.setup_memory()
+
+    async def close(self):
+        """
+        Releases the bot's resources before closing the connection to Discord.
+        """
+        await graph.close_memory()
+        await http_client.close()
+        media_converter.shutdown()
+        await super().close()
+
+bot = Tauleph(command_prefix="", intents=intents, help_command=None)
 
 @bot.event
 async def on_guild_join(guild: discord.Guild):
@@ -33,6 +52,7 @@ async def on_guild_join(guild: discord.Guild):
 @bot.event
 async def on_guild_remove(guild: discord.Guild):
     await config.delete_guild_vars(guild)
+    await graph.purge_guild_history(guild.id)
 
 @bot.event
 async def on_ready():
@@ -45,9 +65,14 @@ async def on_ready():
     await bot.load_extension("bot.cogs.channel_permissions")
     await bot.load_extension("bot.cogs.set_guild_defaults")
     await bot.load_extension("bot.cogs.config_permissions")
+    await bot.load_extension("bot.cogs.memory_management")
+    await bot.load_extension("bot.cogs.media_settings")
+    await bot.load_extension("bot.cogs.search_cache")
 
     await bot.tree.sync()   
 
+    graph.warm_graphs(set(config.guild_models.values())) # Compiles the graphs of the models currently in use.
+
 @bot.event
 async def on_message(message: discord.Message):
     if not await validate_message(message, bot):
@@ -0,0 +1,82 @@
+"""
+Compares sending a voice note inline with uploading it to the Files API.
+
+For every duration, a voice note is encoded with the bot's preprocessing settings and the script prints
+its size, the size of the message that would be checkpointed with it inline, and, if GOOGLE_API_KEY is
+set, how long the model takes to answer with the note inline and uploaded.
+
+Run it from the repository root, with ffmpeg on the PATH:
+    python -m scripts.benchmark_inline_media --seconds 10 30 60 120 --model gemini-2.0-flash-lite
+"""
+from langchain_core.messages import HumanMessage
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from config.config import config
+from llm_graph.files_api import FilesApiCache, FilesApiClient
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import base64
+import os
+import subprocess
+import tempfile
+import time
+import ffmpy
+
+
+def voice_note(seconds: int) -> bytes:
+    """
+    Encodes a voice-like signal of the given duration the way shrink encodes audio.
+    """
+    limits = config.media["preprocess"]
+    ff = ffmpy.FFmpeg(
+        global_options="-loglevel error",
+        inputs={f"anoisesrc=duration={seconds}:color=pink:amplitude=0.3": "-f lavfi"},
+        outputs={"pipe:1": f"-ac {limits['audio_channels']} -ar {limits['audio_sample_rate']} -c:a libopus -b:a {limits['audio_bitrate']} -f ogg"}
+    )
+    stdout, _ = ff.run(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return stdout
+
+
+async def answer_seconds(llm: ChatGoogleGenerativeAI, part: dict) -> float:
+    start = time.perf_counter()
+    await llm.ainvoke([HumanMessage(content=[{"type": "text", "text": "Answer with one word: is this audio silent?"}, part])])
+    return time.perf_counter() - start
+
+
+async def main(durations: list, model: str) -> None:
+    serializer = JsonPlusSerializer()
+    use_api = bool(os.getenv("GOOGLE_API_KEY"))
+    if use_api:
+        llm = ChatGoogleGenerativeAI(model=model, max_retries=2)
+    else:
+        print("GOOGLE_API_KEY isn't set, so only the sizes are measured.")
+
+    with tempfile.TemporaryDirectory() as directory:
+        files_api_client = FilesApiClient(config.files_api, FilesApiCache(os.path.join(directory, "files.sqlite"), 0)) # Nothing is reused.
+        print(f"{'Seconds':>8} {'Bytes':>10} {'Checkpointed':>13} {'Inline':>9} {'Upload':>9} {'Uploaded':>9}")
+        for seconds in durations:
+            data = voice_note(seconds)
+            inline_part = {"type": "media", "mime_type": "audio/ogg", "data": base64.b64encode(data).decode()}
+            _, checkpointed = serializer.dumps_typed(HumanMessage(content=[inline_part]))
+            row = f"{seconds:>8} {len(data):>10} {len(checkpointed):>13}"
+            if use_api:
+                inline_seconds = await answer_seconds(llm, inline_part)
+                start = time.perf_counter()
+                file_uri = await files_api_client.upload(data, "audio/ogg")
+                upload_seconds = time.perf_counter() - start
+                uploaded_seconds = await answer_seconds(llm, {"type": "media", "mime_type": "audio/ogg", "file_uri": file_uri})
+                row += f" {inline_seconds:>8.2f}s {upload_seconds:>8.2f}s {upload_seconds + uploaded_seconds:>8.2f}s"
+            print(row)
+        if use_api:
+            print("Inline and Uploaded are the time until the answer, Uploaded includes the upload. "
+                  f"Media up to {config.media['inline_max_bytes']} bytes is sent inline.")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=int, nargs="+", default=[10, 30, 60, 120, 300])
+    parser.add_argument("--model", default=config.default_model)
+    args = parser.parse_args()
+    asyncio.run(main(args.seconds, args.model))
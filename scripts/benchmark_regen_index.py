@@ -0,0 +1,129 @@
+"""
+Times how long the regeneration buttons take to find their checkpoints on a long thread.
+
+Builds a thread with thousands of turns on the SQLite checkpointer, regenerates the last answer a few
+times, and then compares walking the state history (how config_history and ai_config_history worked
+before the regeneration index) with the index, both cold (right after a restart) and warm. It also
+times a turn in another channel while the history is read, since reading holds the checkpointer's lock.
+
+Run it from the repository root:
+    python -m scripts.benchmark_regen_index --turns 3000
+"""
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, ToolMessage
+from langgraph.graph import StateGraph, START, END
+from langgraph.graph.message import add_messages
+from typing import Annotated
+from typing_extensions import TypedDict
+from llm_graph.checkpointer import SqliteCheckpointer
+from llm_graph.graph_manager import config_history, ai_config_history, regen_index
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+
+class State(TypedDict):
+    messages: Annotated[list, add_messages]
+
+
+def build_graph(checkpointer: SqliteCheckpointer, kept_messages: int):
+    """
+    Builds a graph shaped like the bot's: every run adds an answer to the thread. Messages older than the
+    given amount are removed, like summarization does, so the checkpoints stay small.
+    """
+    def chatbot(state: State):
+        removals = [RemoveMessage(id=message.id) for message in state["messages"][:-kept_messages]]
+        return {"messages": [*removals, AIMessage(content=f"Answer {len(state['messages'])}.")]}
+
+    graph_builder = StateGraph(State)
+    graph_builder.add_node("chatbot", chatbot)
+    graph_builder.add_edge(START, "chatbot")
+    graph_builder.add_edge("chatbot", END)
+    return graph_builder.compile(checkpointer=checkpointer)
+
+
+async def legacy_config_history(graph, config: dict) -> dict:
+    """
+    config_history before the index: walks the history until the last non-AI checkpoint.
+    """
+    async for state in graph.aget_state_history(config):
+        messages = state.values.get("messages", [])
+        if not messages:
+            break
+        if not isinstance(messages[-1], AIMessage):
+            return state.config
+
+async def legacy_ai_config_history(graph, config: dict) -> list:
+    """
+    ai_config_history before the index: walks the history and collects the AI answers.
+    """
+    configs_unreversed = []
+    async for state in graph.aget_state_history(config):
+        messages = state.values.get("messages", [])
+        if not messages:
+            break
+        if isinstance(messages[-1], ToolMessage):
+            continue
+        if isinstance(messages[-1], AIMessage) and messages[-1].content:
+            configs_unreversed.append(state.config)
+        else:
+            break
+    return list(reversed(configs_unreversed))
+
+
+async def timed(label: str, coroutine_function, repeats: int) -> None:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        await coroutine_function()
+    elapsed = (time.perf_counter() - start) / repeats
+    print(f"{label:<40} {elapsed * 1000:10.3f} ms")
+
+
+async def main(turns: int, regenerations: int, kept_messages: int, repeats: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        checkpointer = await SqliteCheckpointer.open(os.path.join(directory, "checkpoints.sqlite"))
+        graph = build_graph(checkpointer, kept_messages)
+        config = {"configurable": {"thread_id": "1-1"}}
+
+        start = time.perf_counter()
+        for turn in range(turns):
+            await graph.ainvoke({"messages": [HumanMessage(content=f"Question {turn}.")]}, config)
+        for _ in range(regenerations): # Regenerations resume from the last question.
+            await graph.ainvoke(None, await config_history(graph, config))
+        await checkpointer.conn.flush()
+        print(f"Built {turns} turns and {regenerations} regenerations in {time.perf_counter() - start:.1f} s.")
+
+        assert await legacy_config_history(graph, config) == await config_history(graph, config)
+        print(f"{'Lookup':<40} {'Per call':>12}")
+        await timed("config_history, history walk", lambda: legacy_config_history(graph, config), repeats)
+        await timed("ai_config_history, history walk", lambda: legacy_ai_config_history(graph, config), repeats)
+
+        async def cold_index():
+            regen_index.forget("1-1") # Like after a restart: the thread is seeded from its history once.
+            await config_history(graph, config)
+            await ai_config_history(graph, config)
+        await timed("both, cold index", cold_index, repeats)
+        assert await legacy_ai_config_history(graph, config) == await ai_config_history(graph, config)
+
+        async def other_channel_turn() -> float:
+            start = time.perf_counter()
+            await graph.ainvoke({"messages": [HumanMessage(content="Hi.")]}, {"configurable": {"thread_id": "1-2"}})
+            return time.perf_counter() - start
+        _, walk_blocked = await asyncio.gather(legacy_ai_config_history(graph, config), other_channel_turn())
+        _, seed_blocked = await asyncio.gather(cold_index(), other_channel_turn())
+        print(f"{'turn in another channel, during walk':<40} {walk_blocked * 1000:10.3f} ms")
+        print(f"{'turn in another channel, during seed':<40} {seed_blocked * 1000:10.3f} ms")
+        await timed("config_history, index", lambda: config_history(graph, config), 1000) # Too fast to time once.
+        await timed("ai_config_history, index", lambda: ai_config_history(graph, config), 1000)
+        await checkpointer.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--turns", type=int, default=3000)
+    parser.add_argument("--regenerations", type=int, default=5)
+    parser.add_argument("--kept-messages", type=int, default=40)
+    parser.add_argument("--repeats", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(main(args.turns, args.regenerations, args.kept_messages, args.repeats))
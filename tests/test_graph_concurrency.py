@@ -0,0 +1,90 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from config.config import config
+from entry_point import entry_point
+from llm_graph.graph import graph
+
+
+class SlowFakeChatModel(GenericFakeChatModel):
+    """
+    Fake LLM that takes a while to answer messages containing "slow".
+    """
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    async def _agenerate(self, messages, *args, **kwargs):
+        if any("slow" in str(message.content) for message in messages):
+            await asyncio.sleep(1)
+        return await super()._agenerate(messages, *args, **kwargs)
+
+    async def _astream(self, messages, *args, **kwargs):
+        if any("slow" in str(message.content) for message in messages):
+            await asyncio.sleep(1)
+        async for chunk in super()._astream(messages, *args, **kwargs):
+            yield chunk
+
+
+class StubMessage:
+    def __init__(self, channel, content: str):
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content: str = None, view=None):
+        self.content = content if content is not None else self.content
+        return self
+
+    async def delete(self):
+        self.channel.sent.remove(self)
+
+
+class StubChannel:
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.sent: list[StubMessage] = []
+
+    async def send(self, content: str, view=None):
+        message = StubMessage(self, content)
+        self.sent.append(message)
+        return message
+
+    @asynccontextmanager
+    async def typing(self):
+        yield
+
+
+def stub_message(guild, channel_id: int, text: str):
+    member = SimpleNamespace(display_name="Tauleph", id=1)
+    guild.get_member = lambda member_id: member
+    return SimpleNamespace(guild=guild, channel=StubChannel(channel_id), content=text, attachments=[],
+                           author=SimpleNamespace(display_name="user", id=2))
+
+
+def test_slow_llm_does_not_delay_another_channel(monkeypatch):
+    fake_llm = SlowFakeChatModel(messages=iter(AIMessage(content="answer") for _ in range(10)))
+    monkeypatch.setattr(graph, "get_llm", lambda model: (fake_llm, fake_llm))
+    monkeypatch.setattr(graph, "compiled_graphs", type(graph.compiled_graphs)())
+    guild = SimpleNamespace(id=1)
+    monkeypatch.setitem(config.guild_models, "1", "test-model") # Nothing is saved to the config store.
+    monkeypatch.setitem(config.guild_sys_prompts, "1", "You are $name.")
+    bot = SimpleNamespace(user=SimpleNamespace(id=1))
+
+    async def answer(message) -> float:
+        start = time.perf_counter()
+        await entry_point(message, bot)
+        return time.perf_counter() - start
+
+    async def main():
+        slow, fast = stub_message(guild, 11, "slow question"), stub_message(guild, 12, "fast question")
+        elapsed = await asyncio.gather(answer(slow), answer(fast))
+        return elapsed, slow, fast
+
+    (slow_elapsed, fast_elapsed), slow, fast = asyncio.run(main())
+    assert slow.channel.sent[-1].content == fast.channel.sent[-1].content == "answer"
+    assert slow_elapsed >= 1
+    assert fast_elapsed < 0.5 # The fast channel is answered while the slow LLM call is still pending.
@@ -0,0 +1,39 @@
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from config.config import config
+from llm_graph.graph import graph
+
+
+class ToolFreeFakeChatModel(GenericFakeChatModel):
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+def test_inline_media_of_older_turns_is_not_kept(monkeypatch):
+    fake_llm = ToolFreeFakeChatModel(messages=iter(AIMessage(content="answer") for _ in range(10)))
+    monkeypatch.setattr(graph, "get_llm", lambda model: (fake_llm, fake_llm))
+    monkeypatch.setattr(graph, "compiled_graphs", type(graph.compiled_graphs)())
+    monkeypatch.setitem(config.media, "keep_inline_turns", 1)
+    compiled_graph = graph.get_graph("test-model")
+    thread_config = {"configurable": {"thread_id": "1-3"}}
+    content = [{"type": "text", "text": "look"},
+               {"type": "image_url", "image_url": "data:image/webp;base64,AAAA"},
+               {"type": "media", "mime_type": "audio/ogg", "data": "AAAA"},
+               {"type": "media", "mime_type": "video/mp4", "file_uri": "https://example.com/file"}]
+
+    async def main():
+        await graph.run_graph(compiled_graph, thread_config, [HumanMessage(content=content), SystemMessage(content="system")])
+        first_answer = (await compiled_graph.aget_state(thread_config)).values["messages"]
+        await graph.run_graph(compiled_graph, thread_config, [HumanMessage(content="and now?"), SystemMessage(content="system")])
+        second_answer = (await compiled_graph.aget_state(thread_config)).values["messages"]
+        return first_answer, second_answer
+
+    first_answer, second_answer = asyncio.run(main())
+    assert first_answer[0].content == content # The latest turn keeps its media for follow-up questions.
+    assert second_answer[0].content == [{"type": "text", "text": "look"},
+                                        {"type": "text", "text": "[An image was sent here.]"},
+                                        {"type": "text", "text": "[An audio file was sent here.]"},
+                                        content[3]] # Uploaded media is only a reference, so it's kept.
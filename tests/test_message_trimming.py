@@ -0,0 +1,51 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+from langchain_google_genai.chat_models import ChatGoogleGenerativeAIError
+
+import llm_graph.graph as graph_module
+from llm_graph.graph import graph
+from llm_graph.token_counter import estimate_tokens
+
+
+def _counted(messages: list) -> dict:
+    for i, message in enumerate(messages):
+        message.id = str(i)
+    return {message.id: estimate_tokens(message) for message in messages}
+
+
+def test_current_turn_is_kept_and_its_tool_results_are_truncated():
+    messages = [HumanMessage(content="old " * 2000), SystemMessage(content="prompt"), AIMessage(content="old answer"),
+                HumanMessage(content="search this"), SystemMessage(content="prompt"),
+                AIMessage(content="", tool_calls=[{"name": "searx_search_results", "args": {"query": "this"}, "id": "call"}]),
+                ToolMessage(content="result " * 5000, tool_call_id="call")]
+    token_counts = _counted(messages)
+
+    trimmed = graph.message_trimming({"messages": messages}, token_counts, 6144)
+
+    assert trimmed[:3] == messages[3:6] # The old turn doesn't fit, the current one is kept whole.
+    assert trimmed[3].id == messages[6].id and trimmed[3].content.endswith("[truncated]")
+    assert sum(token_counts[message.id] for message in trimmed) <= 6144
+
+
+def test_older_turns_are_kept_while_they_fit():
+    messages = [HumanMessage(content="first"), SystemMessage(content="prompt"), AIMessage(content="answer"),
+                HumanMessage(content="second"), SystemMessage(content="prompt")]
+    token_counts = _counted(messages)
+
+    assert graph.message_trimming({"messages": list(messages)}, token_counts, 6144) == messages
+
+
+def test_a_failed_summary_leaves_the_history_unfolded(monkeypatch):
+    async def failing_summarize(*args):
+        raise ChatGoogleGenerativeAIError("400 Bad Request")
+    monkeypatch.setattr(graph_module, "summarize", failing_summarize)
+    messages = [HumanMessage(content="old " * 4000), AIMessage(content="answer"), HumanMessage(content="new")]
+    token_counts = _counted(messages)
+    state = {"messages": messages, "summary": "Earlier."}
+
+    summary, removals = asyncio.run(graph.fold_history(None, state, token_counts, 1000))
+
+    assert (summary, removals) == ("Earlier.", [])
+    assert state["messages"] == messages
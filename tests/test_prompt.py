@@ -0,0 +1,26 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from llm_graph.graph import graph
+
+
+def test_only_the_latest_system_prompt_is_sent_with_the_summary():
+    messages = [HumanMessage(content="first"), SystemMessage(content="first prompt"), AIMessage(content="answer"),
+                HumanMessage(content="second"), SystemMessage(content="second prompt")]
+
+    unsummarized = graph.build_prompt(messages, "")
+    summarized = graph.build_prompt(messages, "They talked.")
+
+    assert [message.content for message in unsummarized] == ["second prompt", "first", "answer", "second"]
+    assert summarized[0].content == "second prompt\n\nSummary of the earlier conversation:\nThey talked."
+    assert summarized[1:] == unsummarized[1:]
+
+
+def test_models_without_system_instructions_get_it_in_the_first_human_message():
+    messages = [HumanMessage(content="first"), SystemMessage(content="prompt"), AIMessage(content="answer"),
+                HumanMessage(content=[{"type": "text", "text": "second"}])]
+
+    prompt = graph.build_prompt(messages, "They talked.", system_instruction=False)
+
+    assert not any(isinstance(message, SystemMessage) for message in prompt)
+    assert prompt[0].content == "prompt\n\nSummary of the earlier conversation:\nThey talked.\n\nfirst"
+    assert prompt[0].id == messages[0].id and prompt[1:] == messages[2:]
@@ -0,0 +1,27 @@
+import base64
+from io import BytesIO
+
+from langchain_core.messages import HumanMessage
+from PIL import Image
+
+from config.config import config
+from llm_graph.token_counter import estimate_tokens, MESSAGE_OVERHEAD
+
+
+def test_media_is_estimated_from_its_duration():
+    limits = {**config.media_limits(), "audio_bitrate": "32k", "max_video_seconds": 300}
+    minute_of_audio = base64.b64encode(b"\0" * (32000 // 8 * 60)).decode()
+    inline_audio = HumanMessage(content=[{"type": "media", "mime_type": "audio/ogg", "data": minute_of_audio}])
+    uploaded_video = HumanMessage(content=[{"type": "media", "mime_type": "video/mp4", "file_uri": "https://example.com/file"}])
+
+    assert estimate_tokens(inline_audio, limits) == MESSAGE_OVERHEAD + 60 * 32
+    assert estimate_tokens(uploaded_video, limits) == MESSAGE_OVERHEAD + 300 * 263
+
+
+def test_inline_webp_images_are_counted_by_their_tiles():
+
+    image = BytesIO()
+    Image.new("RGB", (1536, 1024)).save(image, format="WEBP")
+    message = HumanMessage(content=[{"type": "image_url", "image_url": f"data:image/webp;base64,{base64.b64encode(image.getvalue()).decode()}"}])
+
+    assert estimate_tokens(message) == MESSAGE_OVERHEAD + 258 * 2 * 2
@@ -0,0 +1,74 @@
+from tempfile import SpooledTemporaryFile
+from config.config import config
+import aiohttp
+
+
+class DownloadTooLarge(Exception):
+    """
+    Raised when a download goes over the maximum allowed size.
+    """
+
+
+class HttpClient:
+    """
+    Process-wide HTTP client. Every request goes through one pooled session, so connections, TLS sessions
+    and DNS lookups are reused between downloads.
+    """
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self._session: aiohttp.ClientSession = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """
+        The shared session. It's created on first use, since it needs a running event loop.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.settings["connection_limit"],
+                limit_per_host=self.settings["per_host_limit"],
+                ttl_dns_cache=self.settings["dns_cache_seconds"],
+                keepalive_timeout=self.settings["keepalive_seconds"],
+            )
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.settings["timeout_seconds"]))
+        return self._session
+
+    async def download(self, url: str, max_bytes: int = None) -> SpooledTemporaryFile:
+        """
+        Streams the body of the given URL into a file that stays in memory while it's small and spills to
+        disk once it passes the spill threshold.
+
+        Args:
+            url (str): The URL to download.
+            max_bytes (int): The maximum size of the body. Defaults to the configured maximum.
+        Returns:
+            SpooledTemporaryFile: The downloaded body, rewound to the start.
+        Raises:
+            DownloadTooLarge: If the body is bigger than the maximum size.
+            aiohttp.ClientResponseError: If the response status isn't successful.
+        """
+        max_bytes = max_bytes or self.settings["max_download_bytes"]
+        body = SpooledTemporaryFile(max_size=self.settings["spill_threshold_bytes"])
+        try:
+            async with self.session.get(url) as response:
+                response.raise_for_status()
+                if response.content_length and response.content_length > max_bytes: # Fails early when the size is known.
+                    raise DownloadTooLarge(f"{url} is {response.content_length} bytes, the limit is {max_bytes}.")
+                size = 0
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise DownloadTooLarge(f"{url} is over the {max_bytes} bytes limit.")
+                    body.write(chunk)
+        except BaseException:
+            body.close()
+            raise
+        body.seek(0)
+        return body
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+http_client = HttpClient(config.http)
@@ -0,0 +1,49 @@
+from collections import OrderedDict
+import time
+
+
+class TTLCache:
+    """
+    In-memory cache with a maximum number of entries and an optional time to live.
+
+    The least recently used entry is dropped when the cache is full, and entries older than the time to
+    live are treated as missing. Hits and misses are counted.
+    """
+    def __init__(self, maxsize: int, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl # Seconds an entry stays valid. None keeps entries until they're evicted.
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict() # Key -> (stored at, value), least recently used first.
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored under the key, or the default if it's missing or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None or (self.ttl is not None and time.monotonic() - entry[0] > self.ttl):
+            self._entries.pop(key, None)
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value) -> None:
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __contains__(self, key) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and (self.ttl is None or time.monotonic() - entry[0] <= self.ttl)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """
+        Returns the number of entries, hits and misses.
+        """
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}